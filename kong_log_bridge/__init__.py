@@ -1,11 +1,15 @@
 import json
-import simplejson
 
 from bottle import Bottle, abort, request, response
 
-from .transform import transform_log
+from utils.logging import get_stage_timer
 
-SERVER_READY = True
+from .bulk import bulk_body, count_bulk_failures
+from .processor import (CONTENT_TYPE_ERROR, CONTENT_TYPES, DEFAULT_MAX_BODY_BYTES,
+                        NDJSON_CONTENT_TYPE, InvalidLog, LogProcessor)
+
+# Set once the server has started up, and unset when it starts shutting down.
+SERVER_READY = False
 
 
 def json_default_error_handler(http_error):
@@ -13,10 +17,27 @@ def json_default_error_handler(http_error):
     return json.dumps({'error': http_error.body}, separators=(',', ':'))
 
 
-def construct_app(es_client, es_index, **kwargs):
+def read_body(max_bytes):
+    """Read the request body, aborting if it's larger than `max_bytes` bytes."""
+
+    if request.content_length > max_bytes:
+        abort(413, 'Request entity too large')
+
+    body = request.body.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        abort(413, 'Request entity too large')
+
+    return body
+
+
+def construct_app(es_client, es_index, bulk_indexer=None, log_processor=None, sinks=(),
+                  max_body_bytes=DEFAULT_MAX_BODY_BYTES, **kwargs):
     app = Bottle()
     app.default_error_handler = json_default_error_handler
 
+    if log_processor is None:
+        log_processor = LogProcessor(**kwargs)
+
     @app.get('/-/live')
     def live():
         return 'Live'
@@ -31,30 +52,55 @@ def construct_app(es_client, es_index, **kwargs):
 
     @app.post('/logs')
     def logs():
-        if request.headers.get('Content-Type') != 'application/json':
-            abort(415, 'Require "Content-Type: application/json"')
+        content_type = request.headers.get('Content-Type')
+        if content_type not in CONTENT_TYPES:
+            abort(415, CONTENT_TYPE_ERROR)
+
+        stage_timer = get_stage_timer(request.environ)
+
+        with stage_timer.time('read_body'):
+            body = read_body(max_body_bytes)
 
         try:
-            log = request.json
-        except simplejson.JSONDecodeError:
-            abort(400, 'POST data is not valid JSON')
-
-        if not isinstance(log, dict):
-            abort(400, 'POST body must be a JSON object')
-
-        log = transform_log(log,
-                            do_convert_ts=kwargs['convert_ts'],
-                            do_convert_qs_bools=kwargs['convert_qs_bools'],
-                            do_hash_ip=kwargs['hash_ip'],
-                            do_hash_auth=kwargs['hash_auth'],
-                            do_hash_cookie=kwargs['hash_cookie'],
-                            hash_paths=kwargs['hash_path'],
-                            null_paths=kwargs['null_path'],
-                            limit_request_headers=kwargs['limit_request_headers'],
-                            limit_request_querystring=kwargs['limit_request_querystring'],
-                            expose_ips=kwargs['expose_ip'])
-
-        es_client.index(index=es_index, body=log, request_timeout=30)
+            docs = log_processor.process(body, stage_timer,
+                                         ndjson=content_type == NDJSON_CONTENT_TYPE)
+        except InvalidLog as e:
+            abort(e.status, e.message)
+
+        if not docs:
+            # All logs were over quota or duplicates, and dropped.
+            response.status = 204
+            return
+
+        encoded_docs = [(doc_id, doc.encode('utf-8')) for doc_id, doc in docs]
+
+        if bulk_indexer:
+            with stage_timer.time('buffer'):
+                if not bulk_indexer.add_many(encoded_docs):
+                    abort(503, 'Log buffer is full')
+
+        elif len(docs) == 1:
+            doc_id, doc = docs[0]
+            with stage_timer.time('es_index'):
+                es_client.index(index=es_index, id=doc_id, body=doc, request_timeout=30)
+
+        else:
+            with stage_timer.time('es_index'):
+                result = es_client.bulk(body=bulk_body(encoded_docs),
+                                        index=es_index, request_timeout=30)
+            if count_bulk_failures(result):
+                abort(500, 'Failed to index logs')
+
+        # Only remember the logs' IDs once they've been accepted, so retries of logs that failed to
+        # be indexed aren't dropped as duplicates.
+        log_processor.mark_indexed(docs)
+
+        # Only copy logs to the other sinks once they've been accepted, so they don't get copies
+        # of logs Kong will retry. Sinks drop logs themselves if they can't keep up.
+        if sinks:
+            with stage_timer.time('sinks'):
+                for sink in sinks:
+                    sink.add_many(encoded_docs)
 
         response.status = 204
 
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import kong_log_bridge
+import logging
+
+from aiohttp import web
+from elasticsearch import TransportError
+
+from utils.logging import get_stage_timer
+
+from .bulk import BaseBulkIndexer, bulk_body, count_bulk_failures
+from .processor import (CONTENT_TYPE_ERROR, CONTENT_TYPES, DEFAULT_MAX_BODY_BYTES,
+                        NDJSON_CONTENT_TYPE, InvalidLog, LogProcessor)
+from .warmup import WarmUpAttempts, connection_check_result
+
+log = logging.getLogger(__name__)
+
+
+def json_error_response(status, message):
+    return web.Response(status=status,
+                        text=json.dumps({'error': message}, separators=(',', ':')),
+                        content_type='application/json')
+
+
+class AsyncBulkIndexer(BaseBulkIndexer):
+    """
+    Buffers serialized documents, and indexes them in Elasticsearch in bulk, using asyncio.
+
+    The asyncio equivalent of `BulkIndexer`, for use with an `AsyncElasticsearch` client.
+    """
+
+    def __init__(self, es_client, es_index, interval_s, flush_bytes, max_buffer_bytes):
+        super().__init__(es_client, es_index, interval_s, flush_bytes, max_buffer_bytes)
+        self._task = None
+        self._stopping = None
+        # The event loop only keeps weak references to tasks, so keep the flushes started by
+        # `_flush_soon()` until they're done, or they could be garbage collected mid flush.
+        self._flush_tasks = set()
+
+    def _flush_soon(self):
+        task = asyncio.ensure_future(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self):
+        """Index all buffered documents."""
+
+        batch = self._take_batch()
+        if batch is None:
+            return
+
+        result = None
+        try:
+            result = await self.es_client.bulk(body=batch[0], index=self.es_index,
+                                               request_timeout=30)
+        except Exception:
+            log.exception('Failed to index %(count)d logs.', {'count': batch[1]})
+        finally:
+            self._finish_batch(batch, result)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval_s)
+                return
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    def start(self):
+        """Start flushing the buffer periodically. Must be called with an event loop running."""
+
+        self._stopping = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """
+        Stop flushing the buffer periodically, and flush any remaining documents, waiting for any
+        flushes already in progress.
+        """
+
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks)
+
+        await self.flush()
+
+
+async def check_async_es_connection(connection, timeout):
+    """The asyncio equivalent of `check_es_connection()`."""
+
+    try:
+        await connection.perform_request('HEAD', '/', timeout=timeout)
+    except TransportError as e:
+        return connection_check_result(connection, e)
+
+    return connection_check_result(connection)
+
+
+async def warm_async_es_connections(es_client, connections, timeout_s):
+    """The asyncio equivalent of `warm_es_connections()`, for an `AsyncElasticsearch` client."""
+
+    # The async client only creates its connections once it's first used.
+    await es_client.ping()
+
+    attempts = WarmUpAttempts(timeout_s)
+    while True:
+        timeout = attempts.request_timeout()
+        results = await asyncio.gather(*[check_async_es_connection(connection, timeout)
+                                         for connection in
+                                         es_client.transport.connection_pool.connections
+                                         for _ in range(connections)])
+
+        finished = attempts.finish(results)
+        if finished is not None:
+            return finished
+        await asyncio.sleep(attempts.retry_delay())
+
+
+def construct_aio_app(es_client, es_index, bulk_indexer=None, log_processor=None,
+                      middlewares=(), max_body_bytes=DEFAULT_MAX_BODY_BYTES, **kwargs):
+    """
+    Construct an aiohttp app, equivalent to the Bottle app from `construct_app()`.
+
+    `es_client` must be an `AsyncElasticsearch` client, and `bulk_indexer` an `AsyncBulkIndexer`.
+    """
+
+    app = web.Application(client_max_size=max_body_bytes, middlewares=middlewares)
+
+    if log_processor is None:
+        log_processor = LogProcessor(**kwargs)
+
+    async def live(request):
+        return web.Response(text='Live')
+
+    async def ready(request):
+        if kong_log_bridge.SERVER_READY:
+            return web.Response(text='Ready')
+        else:
+            return web.Response(status=503, text='Unavailable')
+
+    async def logs(request):
+        content_type = request.headers.get('Content-Type')
+        if content_type not in CONTENT_TYPES:
+            return json_error_response(415, CONTENT_TYPE_ERROR)
+
+        stage_timer = get_stage_timer(request)
+
+        with stage_timer.time('read_body'):
+            if (request.content_length or 0) > max_body_bytes:
+                return json_error_response(413, 'Request entity too large')
+            try:
+                body = await request.read()
+            except web.HTTPRequestEntityTooLarge:
+                return json_error_response(413, 'Request entity too large')
+
+        try:
+            docs = log_processor.process(body, stage_timer,
+                                         ndjson=content_type == NDJSON_CONTENT_TYPE)
+        except InvalidLog as e:
+            return json_error_response(e.status, e.message)
+
+        if not docs:
+            # All logs were over quota or duplicates, and dropped.
+            return web.Response(status=204)
+
+        if bulk_indexer:
+            with stage_timer.time('buffer'):
+                if not bulk_indexer.add_many([(doc_id, doc.encode('utf-8'))
+                                              for doc_id, doc in docs]):
+                    return json_error_response(503, 'Log buffer is full')
+
+        elif len(docs) == 1:
+            doc_id, doc = docs[0]
+            with stage_timer.time('es_index'):
+                await es_client.index(index=es_index, id=doc_id, body=doc, request_timeout=30)
+
+        else:
+            with stage_timer.time('es_index'):
+                result = await es_client.bulk(body=bulk_body((doc_id, doc.encode('utf-8'))
+                                                             for doc_id, doc in docs),
+                                              index=es_index, request_timeout=30)
+            if count_bulk_failures(result):
+                return json_error_response(500, 'Failed to index logs')
+
+        log_processor.mark_indexed(docs)
+
+        return web.Response(status=204)
+
+    app.router.add_get('/-/live', live)
+    app.router.add_get('/-/ready', ready)
+    app.router.add_post('/logs', logs)
+
+    return app
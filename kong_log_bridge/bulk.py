@@ -0,0 +1,190 @@
+import gevent
+import json
+import logging
+
+from gevent.event import Event
+
+log = logging.getLogger(__name__)
+
+
+class BulkBuffer:
+    """
+    Serialized documents waiting to be indexed, stored as a ready made Elasticsearch `_bulk` body.
+
+    Documents are appended to a single `bytearray`, rather than held as dicts, to keep the memory
+    used per document close to its serialized size, and avoid re-serializing when sending.
+    `len()` gives the size of the buffered body in bytes, and `count` the number of documents.
+    """
+
+    def __init__(self):
+        self._body = bytearray()
+        self.count = 0
+
+    def __len__(self):
+        return len(self._body)
+
+    def add(self, doc, doc_id=None):
+        """Add a serialized (bytes) JSON document to the buffer, with an optional document ID."""
+
+        if doc_id is None:
+            self._body += b'{"index":{}}\n'
+        else:
+            self._body += b'{"index":{"_id":%b}}\n' % json.dumps(doc_id).encode('utf-8')
+
+        self._body += doc
+        self._body += b'\n'
+        self.count += 1
+
+    def take(self):
+        """Remove and return the buffered body as bytes, and the number of documents it contains."""
+
+        body, count = bytes(self._body), self.count
+        self._body = bytearray()
+        self.count = 0
+        return body, count
+
+
+def bulk_body(docs):
+    """Build an Elasticsearch `_bulk` body (bytes) from `(doc_id, doc)` tuples of serialized docs."""
+
+    bulk_buffer = BulkBuffer()
+    for doc_id, doc in docs:
+        bulk_buffer.add(doc, doc_id)
+    return bulk_buffer.take()[0]
+
+
+def count_bulk_failures(result):
+    """Count the documents that failed to be indexed, from an Elasticsearch `_bulk` response."""
+
+    if not result.get('errors'):
+        return 0
+
+    return sum(1 for item in result['items'] if item.get('index', {}).get('status', 200) >= 300)
+
+
+class BaseBulkIndexer:
+    """
+    Buffers serialized documents, to be indexed in Elasticsearch in bulk.
+
+    The buffer should be flushed every `interval_s` seconds, or as soon as it reaches `flush_bytes`
+    bytes. New documents are rejected if the total size of documents buffered and being sent would
+    exceed `max_buffer_bytes`.
+
+    This handles adding documents to the buffer, and accounting for documents being sent. Subclasses
+    implement `_flush_soon()`, `flush()`, `start()` and `stop()` for their concurrency framework,
+    using `_take_batch()` and `_finish_batch()` around sending each batch.
+    """
+
+    def __init__(self, es_client, es_index, interval_s, flush_bytes, max_buffer_bytes):
+        self.es_client = es_client
+        self.es_index = es_index
+        self.interval_s = interval_s
+        self.flush_bytes = flush_bytes
+        self.max_buffer_bytes = max_buffer_bytes
+
+        self._buffer = BulkBuffer()
+        self._in_flight_bytes = 0
+
+    @property
+    def pending_bytes(self):
+        """The total size of documents buffered and being sent, in bytes."""
+
+        return len(self._buffer) + self._in_flight_bytes
+
+    def add(self, doc, doc_id=None):
+        """
+        Add a serialized (bytes) JSON document to be indexed.
+
+        Returns `False` if the buffer is full and the document wasn't added.
+        """
+
+        return self.add_many([(doc_id, doc)])
+
+    def add_many(self, docs):
+        """
+        Add `(doc_id, doc)` tuples of serialized (bytes) JSON documents to be indexed.
+
+        Either all the documents are added, or if they don't all fit in the buffer, none are and
+        `False` is returned.
+        """
+
+        if self.pending_bytes + sum(len(doc) for _, doc in docs) > self.max_buffer_bytes:
+            return False
+
+        for doc_id, doc in docs:
+            self._buffer.add(doc, doc_id)
+
+        if len(self._buffer) >= self.flush_bytes:
+            self._flush_soon()
+
+        return True
+
+    def _flush_soon(self):
+        raise NotImplementedError()
+
+    def _take_batch(self):
+        # Take the buffered body and document count to send, or `None` if there's nothing to send.
+        if not self._buffer.count:
+            return None
+
+        body, count = self._buffer.take()
+        self._in_flight_bytes += len(body)
+        return body, count
+
+    def _finish_batch(self, batch, result=None):
+        # Account for a batch from `_take_batch()` having been sent, with its `_bulk` response, or
+        # `None` if sending it failed.
+        body, count = batch
+        self._in_flight_bytes -= len(body)
+
+        if result is not None:
+            failed = count_bulk_failures(result)
+            if failed:
+                log.error('Failed to index %(failed)d of %(count)d logs.',
+                          {'failed': failed, 'count': count})
+
+
+class BulkIndexer(BaseBulkIndexer):
+    """Buffers serialized documents, and indexes them in Elasticsearch in bulk, using gevent."""
+
+    def __init__(self, es_client, es_index, interval_s, flush_bytes, max_buffer_bytes):
+        super().__init__(es_client, es_index, interval_s, flush_bytes, max_buffer_bytes)
+        self._greenlet = None
+        self._stopping = Event()
+
+    def _flush_soon(self):
+        gevent.spawn(self.flush)
+
+    def flush(self):
+        """Index all buffered documents."""
+
+        batch = self._take_batch()
+        if batch is None:
+            return
+
+        result = None
+        try:
+            result = self.es_client.bulk(body=batch[0], index=self.es_index, request_timeout=30)
+        except Exception:
+            log.exception('Failed to index %(count)d logs.', {'count': batch[1]})
+        finally:
+            self._finish_batch(batch, result)
+
+    def _run(self):
+        while not self._stopping.wait(timeout=self.interval_s):
+            self.flush()
+
+    def start(self):
+        """Start flushing the buffer periodically."""
+
+        self._greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        """Stop flushing the buffer periodically, and flush any remaining documents."""
+
+        self._stopping.set()
+        if self._greenlet is not None:
+            self._greenlet.join()
+            self._greenlet = None
+
+        self.flush()
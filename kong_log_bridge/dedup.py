@@ -0,0 +1,114 @@
+import hashlib
+import math
+
+from time import monotonic
+
+from .transform import DEFAULT_HASHER, get_path
+
+
+def document_id(log, id_paths, hasher=DEFAULT_HASHER):
+    """
+    Derive an Elasticsearch document ID from the values of fields in a log
+
+    The values at each of `id_paths` are hashed together with `hasher`, so the ID is a fixed length
+    regardless of the values, and the same log will always get the same ID. Use the same (keyed)
+    `hasher` as the log's other values, so IDs derived from sensitive fields (e.g. the client IP)
+    can't be reversed by brute force. Returns `None` if none of the paths match a (non-null) value
+    in the log.
+    """
+
+    values = [get_path(log, path) for path in id_paths]
+    if all(value is None for value in values):
+        return None
+
+    return hasher(values)
+
+
+class BloomFilter:
+    """
+    A Bloom filter of strings, sized for a given number of bytes and false positive rate.
+
+    The number of items the filter can hold while maintaining the false positive rate is available
+    as `capacity`, and the number added so far as `count`.
+    """
+
+    def __init__(self, size_bytes, fp_rate):
+        if size_bytes < 1:
+            raise ValueError('Bloom filter size must be at least 1 byte')
+        if not 0 < fp_rate < 1:
+            raise ValueError('Bloom filter false positive rate must be between 0 and 1')
+
+        self.size_bits = size_bytes * 8
+        self.num_hashes = max(1, round(-math.log2(fp_rate)))
+        self.capacity = max(1, int(-self.size_bits * math.log(2) ** 2 / math.log(fp_rate)))
+        self.count = 0
+        self._bits = bytearray(size_bytes)
+
+    def _bit_indexes(self, item):
+        # Derive all the bit indexes from two 64 bit hashes (Kirsch-Mitzenmacher double hashing),
+        # so only one real hash needs to be calculated per item.
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, item):
+        bits = self._bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._bit_indexes(item))
+
+    def add(self, item):
+        bits = self._bits
+        for i in self._bit_indexes(item):
+            bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+
+class Deduplicator:
+    """
+    Remembers recently seen document IDs, to drop duplicates before they're sent to Elasticsearch.
+
+    IDs are stored in two Bloom filter "generations", splitting `size_bytes` between them. New IDs
+    are added to the current generation, and IDs are checked against both. The generations are
+    rotated - the previous one discarded, and a new empty one started - every `window_s` seconds,
+    or sooner if the current generation fills up. IDs are therefore remembered for at least
+    `window_s` seconds (unless traffic exceeds the filters' capacity), while the false positive rate
+    stays within `fp_rate`. As IDs are checked against both generations, each is sized for a false
+    positive rate of `1 - sqrt(1 - fp_rate)`, so their combined rate is `fp_rate`.
+    """
+
+    def __init__(self, window_s, size_bytes, fp_rate, clock=monotonic):
+        self.window_s = window_s
+        self.fp_rate = fp_rate
+        self._generation_bytes = max(1, size_bytes // 2)
+        self._generation_fp_rate = 1 - math.sqrt(1 - fp_rate)
+        self._clock = clock
+
+        self._current = BloomFilter(self._generation_bytes, self._generation_fp_rate)
+        self._previous = BloomFilter(self._generation_bytes, self._generation_fp_rate)
+        self._rotated_at = clock()
+
+    def _rotate_if_needed(self):
+        now = self._clock()
+        if (now - self._rotated_at >= self.window_s or
+                self._current.count >= self._current.capacity):
+            self._previous = self._current
+            self._current = BloomFilter(self._generation_bytes, self._generation_fp_rate)
+            self._rotated_at = now
+
+    def contains(self, doc_id):
+        """Check if a document ID has been seen recently."""
+
+        self._rotate_if_needed()
+        return doc_id in self._current or doc_id in self._previous
+
+    def add(self, doc_id):
+        """
+        Remember a document ID as seen.
+
+        IDs should only be added once their document has been indexed (or buffered for indexing), so
+        retries of logs that failed to be indexed aren't dropped.
+        """
+
+        self._rotate_if_needed()
+        if doc_id not in self._current:
+            self._current.add(doc_id)
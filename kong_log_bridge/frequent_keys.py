@@ -0,0 +1,52 @@
+import heapq
+
+
+class FrequentKeys:
+    """
+    Tracks how frequently dictionary keys are seen across logs, in bounded space.
+
+    Key counts are estimated with a Misra-Gries heavy hitters sketch holding up to `capacity`
+    counters. Any key making up more than `1 / (capacity + 1)` of all keys seen is guaranteed to be
+    tracked. Updating the sketch takes amortized constant time per key.
+
+    The `limit` most frequent keys are available as `top_keys`. To keep the set stable, it's only
+    recalculated every `refresh_interval` observations (more often while warming up).
+    """
+
+    def __init__(self, limit, capacity=None, refresh_interval=1000):
+        self.limit = limit
+        self.capacity = capacity if capacity is not None else max(limit * 10, 1)
+        self.refresh_interval = refresh_interval
+        self.top_keys = frozenset()
+
+        self._counts = {}
+        self._since_refresh = 0
+        self._next_refresh = 1
+
+    def observe(self, keys):
+        """Record a set of keys (e.g. from one dictionary) being seen."""
+
+        counts = self._counts
+        for key in keys:
+            if key in counts:
+                counts[key] += 1
+            elif len(counts) < self.capacity:
+                counts[key] = 1
+            else:
+                # No free counters, so decrement all of them (and the new key's implicit count of
+                # one), dropping any that reach zero.
+                counts = {k: c - 1 for k, c in counts.items() if c > 1}
+                self._counts = counts
+
+        self._since_refresh += 1
+        if self._since_refresh >= self._next_refresh:
+            self.refresh()
+
+    def refresh(self):
+        """Recalculate `top_keys` from the current key counts."""
+
+        counts = self._counts
+        self.top_keys = frozenset(heapq.nlargest(self.limit, counts, key=counts.get))
+
+        self._since_refresh = 0
+        self._next_refresh = min(self._next_refresh * 2, self.refresh_interval)
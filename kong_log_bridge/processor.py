@@ -0,0 +1,339 @@
+import json
+import logging
+import os
+
+from utils.logging import NULL_STAGE_TIMER
+from utils.lru import LRUCache
+
+from .dedup import Deduplicator, document_id
+from .frequent_keys import FrequentKeys
+from .quota import Quotas
+from .splice import decode_logs, encode_object
+from .transform import Hasher, compile_value_limits, transform_log, transform_logs
+
+log = logging.getLogger(__name__)
+
+# blake2b's maximum key length
+MAX_HASH_KEY_BYTES = 64
+
+# Default maximum request body size, in bytes (Bottle's default MEMFILE_MAX).
+DEFAULT_MAX_BODY_BYTES = 102_400
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+CONTENT_TYPES = ('application/json', NDJSON_CONTENT_TYPE)
+CONTENT_TYPE_ERROR = ('Require "Content-Type: application/json" or '
+                      '"Content-Type: application/x-ndjson"')
+
+# Options that can be set in a config file, and reloaded without restarting, with their types.
+RELOADABLE_OPTIONS = {
+    'convert_ts': bool,
+    'convert_qs_bools': bool,
+    'hash_ip': bool,
+    'hash_auth': bool,
+    'hash_cookie': bool,
+    'hash_path': list,
+    'null_path': list,
+    'limit_request_headers': int,
+    'limit_request_querystring': int,
+    'limit_keys_by': str,
+    'max_value_bytes': int,
+    'max_value_bytes_path': list,
+    'hash_truncated_values': bool,
+    'sub_object_cache_size': int,
+    'expose_ip': list,
+}
+OPTION_TYPE_NAMES = {
+    bool: 'a boolean',
+    int: 'an integer',
+    str: 'a string',
+    list: 'an array of strings',
+}
+LIMIT_KEYS_BY = ('arrival', 'frequency')
+
+
+class InvalidLog(Exception):
+    """Raised when a log can't be processed, with the HTTP status and message to respond with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def load_hash_key(hash_key=None, hash_key_file=None):
+    """
+    Load the key to hash values with, from a string or a file (trailing newlines are ignored).
+
+    Returns `None` if no key is provided.
+    """
+
+    if hash_key_file:
+        with open(hash_key_file, 'rb') as f:
+            key = f.read().rstrip(b'\r\n')
+    elif hash_key:
+        key = hash_key.encode('utf-8')
+    else:
+        return None
+
+    if not key:
+        raise ValueError('Hash key is empty')
+    if len(key) > MAX_HASH_KEY_BYTES:
+        raise ValueError(f'Hash key is longer than {MAX_HASH_KEY_BYTES} bytes')
+
+    return key
+
+
+def parse_path_limits(path_limits):
+    """Parse `<path>=<limit>` strings into a dict mapping paths to (int) limits."""
+
+    parsed = {}
+    for path_limit in path_limits:
+        path, sep, limit = path_limit.rpartition('=')
+        if not sep or not path:
+            raise ValueError(f'Path limit "{path_limit}" is not in the form <path>=<limit>')
+        parsed[path] = int(limit)
+
+    return parsed
+
+
+def load_config_file(path):
+    """
+    Load reloadable options from a JSON config file.
+
+    The file must contain a JSON object, with keys named as the CLI options, e.g. `hash-path` (or
+    `hash_path`). Options that can be specified multiple times take lists. Returns a dict of options
+    named as the CLI option kwargs. Raises `ValueError` if the file isn't valid.
+    """
+
+    with open(path, 'rb') as f:
+        config = json.loads(f.read().decode('utf-8'))
+
+    if not isinstance(config, dict):
+        raise ValueError('Config file must contain a JSON object')
+
+    options = {}
+    for key, value in config.items():
+        name = key.replace('-', '_')
+        option_type = RELOADABLE_OPTIONS.get(name)
+        if option_type is None:
+            raise ValueError(f'Option "{key}" can\'t be set in the config file')
+
+        # bools are ints in Python, but shouldn't be accepted as them.
+        if (not isinstance(value, option_type)
+                or (option_type is int and isinstance(value, bool))
+                or (option_type is list and not all(isinstance(v, str) for v in value))):
+            raise ValueError(f'Option "{key}" must be {OPTION_TYPE_NAMES[option_type]}')
+
+        if name == 'limit_keys_by' and value not in LIMIT_KEYS_BY:
+            raise ValueError(f'Option "{key}" must be one of {", ".join(LIMIT_KEYS_BY)}')
+
+        options[name] = value
+
+    return options
+
+
+class LogProcessor:
+    """
+    Processes raw request logs into documents to index, as configured by the CLI options.
+
+    This is independent of any web framework, so can be shared by the different server engines.
+    """
+
+    def __init__(self, **kwargs):
+        self.quotas = None
+        if kwargs.get('quota_key_path') and kwargs.get('quota_rate'):
+            self.quotas = Quotas(kwargs['quota_key_path'],
+                                 rate=kwargs['quota_rate'],
+                                 burst=kwargs['quota_burst'] or max(kwargs['quota_rate'], 1),
+                                 max_keys=kwargs['quota_max_keys'],
+                                 sample_rate=kwargs['quota_sample_rate'])
+
+        self.id_paths = kwargs.get('es_id_path')
+
+        self.deduplicator = None
+        if self.id_paths and kwargs.get('dedup_window'):
+            self.deduplicator = Deduplicator(window_s=kwargs['dedup_window'],
+                                             size_bytes=kwargs['dedup_memory'] * 1024,
+                                             fp_rate=kwargs['dedup_fp_rate'])
+
+        self.sub_object_cache = None
+        if kwargs.get('sub_object_cache_size'):
+            self.sub_object_cache = LRUCache(kwargs['sub_object_cache_size'])
+
+        self.transform_options = {
+            'do_convert_ts': kwargs['convert_ts'],
+            'do_convert_qs_bools': kwargs['convert_qs_bools'],
+            'do_hash_ip': kwargs['hash_ip'],
+            'do_hash_auth': kwargs['hash_auth'],
+            'do_hash_cookie': kwargs['hash_cookie'],
+            'hash_paths': kwargs['hash_path'],
+            'null_paths': kwargs['null_path'],
+            'limit_request_headers': kwargs['limit_request_headers'],
+            'limit_request_querystring': kwargs['limit_request_querystring'],
+            # Exposed IPs are checked for every log, so use a set for fast lookups.
+            'expose_ips': frozenset(kwargs['expose_ip']),
+            'hasher': Hasher(key=load_hash_key(kwargs.get('hash_key'), kwargs.get('hash_key_file'))),
+        }
+
+        if kwargs.get('max_value_bytes') or kwargs.get('max_value_bytes_path'):
+            path_limits = parse_path_limits(kwargs.get('max_value_bytes_path') or [])
+            self.transform_options.update({
+                'value_limits': compile_value_limits(kwargs.get('max_value_bytes'), path_limits),
+                'hash_truncated_values': kwargs.get('hash_truncated_values', False),
+            })
+
+        if kwargs.get('limit_keys_by') == 'frequency':
+            self.transform_options.update({
+                'request_headers_keys': FrequentKeys(kwargs['limit_request_headers']),
+                'request_querystring_keys': FrequentKeys(kwargs['limit_request_querystring']),
+            })
+
+    def process(self, body, stage_timer=NULL_STAGE_TIMER, ndjson=False):
+        """
+        Process a raw (bytes) request body containing a log, or a batch of logs.
+
+        A batch can be a JSON array of logs, or newline delimited JSON (NDJSON) logs if `ndjson` is
+        set. Returns a list of `(doc_id, doc)` tuples of the ID (or `None`) and serialized JSON (str)
+        of each document to index. Logs over quota, or duplicates of documents passed to
+        `mark_indexed()`, are dropped. Raises `InvalidLog` if any of the logs are invalid.
+        """
+
+        with stage_timer.time('decode'):
+            try:
+                items = decode_logs(body.decode('utf-8'), ndjson=ndjson)
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                raise InvalidLog(400, 'POST data is not valid JSON')
+
+        if not all(isinstance(log, dict) for log, _, _ in items):
+            raise InvalidLog(400, 'POST body must be a JSON object, or an array of JSON objects')
+
+        kept = []
+        batch_ids = set()
+        for log, text, spans in items:
+            if self.quotas and not self.quotas.allow(log):
+                continue
+
+            # Derive the document ID from the log before it's transformed, as the transformation
+            # could remove or change the ID fields.
+            doc_id = (document_id(log, self.id_paths, self.transform_options['hasher'])
+                      if self.id_paths else None)
+
+            if self.deduplicator and doc_id:
+                # Also drop duplicates within the batch, which haven't been indexed yet.
+                if self.deduplicator.contains(doc_id) or doc_id in batch_ids:
+                    continue
+                batch_ids.add(doc_id)
+
+            kept.append((doc_id, log, text, spans))
+
+        if not kept:
+            return []
+
+        original_logs = [log for _, log, _, _ in kept]
+        with stage_timer.time('transform'):
+            if len(original_logs) == 1:
+                logs = [transform_log(original_logs[0], sub_object_cache=self.sub_object_cache,
+                                      **self.transform_options)]
+            else:
+                logs = transform_logs(original_logs, sub_object_cache=self.sub_object_cache,
+                                      **self.transform_options)
+
+        # Serialize the logs ourselves, rather than leaving it to the Elasticsearch client, so parts
+        # of the logs that weren't transformed can be copied from the request body as is.
+        with stage_timer.time('serialize'):
+            return [(doc_id, encode_object(log, original_log, text, spans))
+                    for log, (doc_id, original_log, text, spans) in zip(logs, kept)]
+
+    def mark_indexed(self, docs):
+        """
+        Remember the IDs of `(doc_id, doc)` tuples from `process()` that have been indexed (or
+        buffered for indexing), so duplicates of them are dropped.
+        """
+
+        if self.deduplicator:
+            for doc_id, _ in docs:
+                if doc_id:
+                    self.deduplicator.add(doc_id)
+
+    def reconfigured(self, **kwargs):
+        """
+        Build a new processor with different options, keeping this processor's quotas and duplicate
+        tracking, as they're not reloadable options.
+        """
+
+        # Disable quotas and deduplication when building the new processor, to avoid allocating them
+        # just to replace them.
+        processor = LogProcessor(**{**kwargs, 'quota_rate': 0, 'dedup_window': 0})
+        processor.quotas = self.quotas
+        processor.deduplicator = self.deduplicator
+        return processor
+
+
+class ReloadableLogProcessor:
+    """
+    Processes logs with a `LogProcessor`, built from `options` overridden by a config file, that can
+    be reloaded without restarting.
+
+    Reloading builds a new `LogProcessor` then swaps it in with a single assignment, so logs being
+    processed during a reload finish with the old processor, and no locking is needed on the hot
+    path. If the config file is invalid when reloading, an error is logged and the current processor
+    is kept.
+    """
+
+    def __init__(self, config_file, options):
+        self.config_file = config_file
+        self.options = options
+
+        self._file_state = self._stat()
+        self.processor = LogProcessor(**self._options())
+
+    @property
+    def quotas(self):
+        return self.processor.quotas
+
+    @property
+    def transform_options(self):
+        return self.processor.transform_options
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.config_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _options(self):
+        return {**self.options, **load_config_file(self.config_file)}
+
+    def reload(self):
+        """Reload the config file. Returns whether it was reloaded successfully."""
+
+        self._file_state = self._stat()
+        try:
+            self.processor = self.processor.reconfigured(**self._options())
+        except Exception:
+            log.exception('Failed to reload config file %(path)s. Keeping the current config.',
+                          {'path': self.config_file})
+            return False
+
+        log.info('Reloaded config file %(path)s.', {'path': self.config_file})
+        return True
+
+    def reload_if_changed(self):
+        """Reload the config file if it has changed since it was last loaded."""
+
+        if self._stat() != self._file_state:
+            return self.reload()
+        return False
+
+    def process(self, body, stage_timer=NULL_STAGE_TIMER, ndjson=False):
+        """Process a raw request body, as `LogProcessor.process()`."""
+
+        # Only read the current processor once, so it's used for the whole request even if the
+        # config is reloaded part way through.
+        return self.processor.process(body, stage_timer, ndjson=ndjson)
+
+    def mark_indexed(self, docs):
+        """Remember the IDs of indexed documents, as `LogProcessor.mark_indexed()`."""
+
+        self.processor.mark_indexed(docs)
@@ -0,0 +1,129 @@
+import json
+import random
+import rfc3339
+import time
+
+from time import monotonic
+
+from utils.lru import LRUCache
+
+from .transform import get_path
+
+# Key that drops are counted under once the maximum number of keys is being counted.
+OTHER_KEY = '_other'
+
+
+class Quotas:
+    """
+    Limits the rate of logs for each value of one or more fields (e.g. `service.name`).
+
+    Each value of each field in `key_paths` has a token bucket, refilled at `rate` logs per second up
+    to `burst` logs. A log is over quota if any of its buckets is empty. Over quota logs are dropped,
+    except for a `sample_rate` proportion of them.
+
+    Buckets are kept in an LRU cache of up to `max_keys` entries, so memory use is bounded no matter
+    how many different values are seen. Drops are counted per value (again, up to `max_keys` values)
+    until `take_summary_documents()` is called.
+
+    A log takes a whole token, so `burst` must be at least 1, even if `rate` is less than 1 log per
+    second.
+    """
+
+    def __init__(self, key_paths, rate, burst, max_keys, sample_rate=0.0, clock=monotonic):
+        if burst < 1:
+            raise ValueError('Quota burst must be at least 1')
+
+        self.key_paths = key_paths
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.sample_rate = sample_rate
+        self._clock = clock
+
+        self._buckets = LRUCache(max_keys)
+        self._drop_counts = {}
+        self._period_start = time.time()
+
+    def _count(self, bucket_key, sampled):
+        if bucket_key not in self._drop_counts and len(self._drop_counts) >= self.max_keys:
+            bucket_key = (bucket_key[0], OTHER_KEY)
+
+        counts = self._drop_counts.setdefault(bucket_key, {'dropped': 0, 'sampled': 0})
+        counts['sampled' if sampled else 'dropped'] += 1
+
+    def allow(self, log):
+        """
+        Check if a log is within quota (or sampled), taking a token from each of its buckets if so.
+
+        Tokens are only taken for logs that are kept, so logs dropped by one field value's quota
+        don't use up the quotas of the log's other field values.
+        """
+
+        now = self._clock()
+        buckets = []
+        over_quota = []
+
+        for path in self.key_paths:
+            key = get_path(log, path)
+            if key is None:
+                continue
+            if not isinstance(key, str):
+                key = json.dumps(key, separators=(',', ':'))
+
+            bucket_key = (path, key)
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                # Buckets are [tokens, last refill time]
+                bucket = [self.burst, now]
+                self._buckets.put(bucket_key, bucket)
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            buckets.append(bucket)
+            if bucket[0] < 1:
+                over_quota.append(bucket_key)
+
+        if over_quota:
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+            for bucket_key in over_quota:
+                self._count(bucket_key, sampled)
+
+            if not sampled:
+                return False
+
+        # Sampled logs also take tokens from their buckets that aren't empty, as they're kept.
+        for bucket in buckets:
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+
+        return True
+
+    def take_summary_documents(self, convert_ts=False):
+        """
+        Get serialized JSON summary documents of the drops counted since the last call, and reset the
+        counts.
+
+        There's one document per over quota field value, with the end of the summary period as the
+        `started_at` timestamp - as an RFC3339 string if `convert_ts` is set, otherwise as a UNIX
+        timestamp in milliseconds, to match the logs.
+        """
+
+        drop_counts = self._drop_counts
+        period_start = self._period_start
+        self._drop_counts = {}
+        self._period_start = period_end = time.time()
+
+        if convert_ts:
+            started_at = rfc3339.timestamptostr(period_end)
+        else:
+            started_at = int(period_end * 1000)
+
+        return [json.dumps({'started_at': started_at,
+                            'quota_summary': {'key_path': path,
+                                              'key': key,
+                                              'dropped': counts['dropped'],
+                                              'sampled': counts['sampled'],
+                                              'period_s': round(period_end - period_start, 3)}},
+                           separators=(',', ':'))
+                for (path, key), counts in drop_counts.items()]
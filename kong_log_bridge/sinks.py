@@ -0,0 +1,257 @@
+import gevent
+import gzip
+import logging
+import os
+import time
+
+from contextlib import suppress
+from gevent.event import Event
+from gevent.queue import Empty, Queue
+
+from .bulk import bulk_body, count_bulk_failures
+
+log = logging.getLogger(__name__)
+
+# Queued to tell a worker greenlet to exit.
+_STOP = object()
+
+
+class Sink:
+    """
+    Sends copies of serialized documents somewhere, independently of ingest and any other sinks.
+
+    Documents are collected into batches, which are sent by `workers` worker greenlets. A batch is
+    queued for sending every `interval_s` seconds, or as soon as it reaches `batch_bytes` bytes.
+    If the total size of documents batched, queued and being sent would exceed `max_queue_bytes`,
+    new documents are dropped, so a slow or failing sink never holds up ingest. Batches that fail to
+    send are retried up to `retries` times, with exponential backoff starting at `retry_backoff_s`
+    seconds, then dropped.
+
+    Subclasses implement `write_batch()`, and optionally `idle()`.
+    """
+
+    def __init__(self, name, interval_s, batch_bytes, max_queue_bytes, workers=1, retries=0,
+                 retry_backoff_s=1.0):
+        self.name = name
+        self.interval_s = interval_s
+        self.batch_bytes = batch_bytes
+        self.max_queue_bytes = max_queue_bytes
+        self.workers = workers
+        self.retries = retries
+        self.retry_backoff_s = retry_backoff_s
+
+        self.pending_bytes = 0
+        self.dropped = 0
+
+        self._batch = []
+        self._batch_bytes = 0
+        self._queue = Queue()
+        self._greenlets = []
+        self._stopping = Event()
+
+    def add_many(self, docs):
+        """
+        Add `(doc_id, doc)` tuples of serialized (bytes) JSON documents to be sent.
+
+        Either all the documents are added, or if they don't all fit in the queue, none are and
+        `False` is returned.
+        """
+
+        size = sum(len(doc) for _, doc in docs)
+        if self.pending_bytes + size > self.max_queue_bytes:
+            self.dropped += len(docs)
+            return False
+
+        self.pending_bytes += size
+        self._batch.extend(docs)
+        self._batch_bytes += size
+
+        if self._batch_bytes >= self.batch_bytes:
+            self._queue_batch()
+
+        return True
+
+    def _queue_batch(self):
+        if self._batch:
+            self._queue.put((self._batch, self._batch_bytes))
+            self._batch = []
+            self._batch_bytes = 0
+
+    def write_batch(self, docs):
+        """Send a batch of `(doc_id, doc)` tuples. Raise an exception if it should be retried."""
+
+        raise NotImplementedError()
+
+    def idle(self):
+        """Called periodically by each worker greenlet while there are no batches to send."""
+
+    def _send(self, docs):
+        attempt = 0
+        while True:
+            try:
+                self.write_batch(docs)
+                return
+
+            except Exception:
+                # Don't hold up shutdown retrying.
+                if attempt >= self.retries or self._stopping.is_set():
+                    log.exception('%(sink)s sink failed to send %(count)d logs. Dropping them.',
+                                  {'sink': self.name, 'count': len(docs)})
+                    return
+
+                log.warning('%(sink)s sink failed to send %(count)d logs. Retrying.',
+                            {'sink': self.name, 'count': len(docs)}, exc_info=True)
+                self._stopping.wait(timeout=self.retry_backoff_s * 2 ** attempt)
+                attempt += 1
+
+    def _run_worker(self):
+        while True:
+            try:
+                batch = self._queue.get(timeout=self.interval_s)
+            except Empty:
+                try:
+                    self.idle()
+                except Exception:
+                    log.exception('%(sink)s sink failed while idle.', {'sink': self.name})
+                continue
+
+            if batch is _STOP:
+                return
+
+            docs, size = batch
+            try:
+                self._send(docs)
+            finally:
+                self.pending_bytes -= size
+
+    def _run_timer(self):
+        while not self._stopping.wait(timeout=self.interval_s):
+            self._queue_batch()
+
+            if self.dropped:
+                log.warning('%(sink)s sink dropped %(count)d logs, as its queue was full.',
+                            {'sink': self.name, 'count': self.dropped})
+                self.dropped = 0
+
+    def start(self):
+        """Start the worker and batching greenlets."""
+
+        self._greenlets = [gevent.spawn(self._run_worker) for _ in range(self.workers)]
+        self._greenlets.append(gevent.spawn(self._run_timer))
+
+    def stop(self):
+        """Stop the greenlets, once all batched and queued documents have been sent."""
+
+        self._stopping.set()
+        self._queue_batch()
+        for _ in range(self.workers):
+            self._queue.put(_STOP)
+
+        gevent.joinall(self._greenlets)
+        self._greenlets = []
+
+
+class ElasticsearchSink(Sink):
+    """Indexes documents in bulk in an (additional) Elasticsearch cluster."""
+
+    def __init__(self, es_client, es_index, **kwargs):
+        super().__init__(**kwargs)
+        self.es_client = es_client
+        self.es_index = es_index
+
+    def write_batch(self, docs):
+        result = self.es_client.bulk(body=bulk_body(docs), index=self.es_index, request_timeout=30)
+
+        # Only whole requests are retried. Retrying individual documents could duplicate any that
+        # don't have IDs, if their failure was only reported by a proxy.
+        failed = count_bulk_failures(result)
+        if failed:
+            log.error('%(sink)s sink failed to index %(failed)d of %(count)d logs.',
+                      {'sink': self.name, 'failed': failed, 'count': len(docs)})
+
+
+class FileSink(Sink):
+    """
+    Writes documents to gzip compressed JSON lines files in a directory.
+
+    Files are named by the UTC time they were started, and are written with a `.part` suffix, which
+    is removed once they're complete. A file is completed once it reaches `max_file_bytes`
+    (compressed) bytes, or is `max_file_age_s` seconds old.
+
+    Files are written in a single worker greenlet, with the compression and file IO run in gevent's
+    thread pool so they don't block other greenlets.
+    """
+
+    def __init__(self, directory, max_file_bytes, max_file_age_s, compress_level=6, clock=time.time,
+                 **kwargs):
+        super().__init__(workers=1, **kwargs)
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_file_age_s = max_file_age_s
+        self.compress_level = compress_level
+        self._clock = clock
+
+        self._path = None
+        self._raw_file = None
+        self._file = None
+        self._file_started = None
+        self._file_count = 0
+
+    def _open(self):
+        self._file_started = self._clock()
+        self._file_count += 1
+
+        started = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(self._file_started))
+        # Include a count, in case multiple files are started within a second.
+        self._path = os.path.join(self.directory,
+                                  f'kong-requests-{started}-{self._file_count:06d}.jsonl.gz')
+
+        self._raw_file = open(self._path + '.part', 'wb')
+        self._file = gzip.GzipFile(fileobj=self._raw_file, mode='wb',
+                                   compresslevel=self.compress_level)
+
+    def _close(self):
+        if self._file is None:
+            return
+
+        self._file.close()
+        self._raw_file.close()
+        os.rename(self._path + '.part', self._path)
+
+        self._file = self._raw_file = self._path = None
+
+    def _rotate_if_due(self):
+        if self._file is not None and (self._raw_file.tell() >= self.max_file_bytes
+                                       or self._clock() - self._file_started >= self.max_file_age_s):
+            self._close()
+
+    def _write(self, docs):
+        self._rotate_if_due()
+        if self._file is None:
+            self._open()
+
+        try:
+            self._file.write(b''.join(doc + b'\n' for _, doc in docs))
+            # Flush compressed data to the file, so the file's size is up to date, and as few
+            # documents as possible are lost if the process dies.
+            self._file.flush()
+
+        except Exception:
+            # Leave the file as is, and start a new one for the retry, rather than appending to a
+            # file that may now be corrupt.
+            with suppress(OSError):
+                self._raw_file.close()
+            self._file = self._raw_file = self._path = None
+            raise
+
+        self._rotate_if_due()
+
+    def write_batch(self, docs):
+        gevent.get_hub().threadpool.apply(self._write, (docs,))
+
+    def idle(self):
+        gevent.get_hub().threadpool.apply(self._rotate_if_due)
+
+    def stop(self):
+        super().stop()
+        self._close()
@@ -0,0 +1,205 @@
+import json
+import re
+
+from json.decoder import JSONDecodeError, scanstring
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_decoder = json.JSONDecoder()
+
+
+class DuplicateKeyError(JSONDecodeError):
+    """Raised when decoding a JSON object with duplicate keys."""
+
+
+class _DuplicateKeys(Exception):
+    pass
+
+
+def _check_pairs(pairs):
+    obj = dict(pairs)
+    if len(obj) != len(pairs):
+        raise _DuplicateKeys()
+    return obj
+
+
+# Decodes values, failing on objects with duplicate keys.
+_strict_decoder = json.JSONDecoder(object_pairs_hook=_check_pairs)
+
+
+def _skip_whitespace(text, idx):
+    return WHITESPACE.match(text, idx).end()
+
+
+def _raw_decode(text, idx):
+    try:
+        return _strict_decoder.raw_decode(text, idx)
+    except _DuplicateKeys:
+        raise DuplicateKeyError('Duplicate object key', text, idx) from None
+
+
+def _decode_object(text, idx, base):
+    # Decode the object starting at `idx`, with spans relative to `base`.
+    obj = {}
+    spans = {}
+
+    idx = _skip_whitespace(text, idx + 1)
+    if text[idx:idx + 1] == '}':
+        return obj, spans, idx + 1
+
+    while True:
+        if text[idx:idx + 1] != '"':
+            raise JSONDecodeError('Expecting property name enclosed in double quotes', text, idx)
+        start = idx
+        key, idx = scanstring(text, idx + 1)
+        if key in obj:
+            raise DuplicateKeyError('Duplicate object key', text, start)
+
+        idx = _skip_whitespace(text, idx)
+        if text[idx:idx + 1] != ':':
+            raise JSONDecodeError('Expecting \':\' delimiter', text, idx)
+
+        idx = _skip_whitespace(text, idx + 1)
+        value, idx = _raw_decode(text, idx)
+
+        obj[key] = value
+        spans[key] = (start - base, idx - base)
+
+        idx = _skip_whitespace(text, idx)
+        delimiter = text[idx:idx + 1]
+        if delimiter == ',':
+            idx = _skip_whitespace(text, idx + 1)
+        elif delimiter == '}':
+            return obj, spans, idx + 1
+        else:
+            raise JSONDecodeError('Expecting \',\' delimiter', text, idx)
+
+
+def _check_end(text, idx):
+    idx = _skip_whitespace(text, idx)
+    if idx != len(text):
+        raise JSONDecodeError('Extra data', text, idx)
+
+
+def decode_object(text):
+    """
+    Decode a JSON object, also returning the span of text each of its members was decoded from
+
+    Returns the decoded value, and a dict mapping each top level key to the `(start, end)` indexes of
+    its `"key":value` member in `text`. If `text` isn't a JSON object, the decoded value is returned
+    with `None` spans. Raises `JSONDecodeError` if `text` isn't valid JSON, or `DuplicateKeyError`
+    if it (or any object within it) has duplicate keys.
+    """
+
+    idx = _skip_whitespace(text, 0)
+    if text[idx:idx + 1] != '{':
+        value, idx = _raw_decode(text, idx)
+        spans = None
+    else:
+        value, spans, idx = _decode_object(text, idx, 0)
+    _check_end(text, idx)
+
+    return value, spans
+
+
+def _decode_value(text, idx):
+    # Decode the value starting at `idx`, returning it with its own text and spans if it's an object.
+    try:
+        if text[idx:idx + 1] == '{':
+            obj, spans, end = _decode_object(text, idx, idx)
+            return (obj, text[idx:end], spans), end
+        else:
+            value, end = _raw_decode(text, idx)
+            return (value, text[idx:end], None), end
+
+    except DuplicateKeyError:
+        # Elasticsearch rejects documents with duplicate keys, so the text can't be passed through
+        # as is. Collapse them (the last value wins, as with `json.loads()`), and re-encode it.
+        value, end = _decoder.raw_decode(text, idx)
+        item, _ = _decode_value(json.dumps(value, separators=(',', ':')), 0)
+        return item, end
+
+
+def decode_logs(text, ndjson=False):
+    """
+    Decode a JSON value or array of values, or newline delimited JSON (NDJSON) values
+
+    Returns a list of `(value, value_text, spans)` tuples, one per value (i.e. per array item for
+    arrays). For objects, `spans` are as for `decode_object()`, with indexes into `value_text`, so
+    the tuple can be used with `encode_object()`. For other values `spans` is `None`. Values with
+    duplicate object keys keep the last value for each key, and `value_text` is re-encoded without
+    the duplicates. Raises `JSONDecodeError` if `text` isn't valid (ND)JSON.
+    """
+
+    if ndjson:
+        items = []
+        for line in text.split('\n'):
+            idx = _skip_whitespace(line, 0)
+            if idx == len(line):
+                continue
+            item, idx = _decode_value(line, idx)
+            _check_end(line, idx)
+            items.append(item)
+
+        return items
+
+    idx = _skip_whitespace(text, 0)
+    if text[idx:idx + 1] != '[':
+        item, idx = _decode_value(text, idx)
+        _check_end(text, idx)
+        return [item]
+
+    items = []
+    idx = _skip_whitespace(text, idx + 1)
+    if text[idx:idx + 1] == ']':
+        idx += 1
+
+    else:
+        while True:
+            item, idx = _decode_value(text, idx)
+            items.append(item)
+
+            idx = _skip_whitespace(text, idx)
+            delimiter = text[idx:idx + 1]
+            if delimiter == ',':
+                idx = _skip_whitespace(text, idx + 1)
+            elif delimiter == ']':
+                idx += 1
+                break
+            else:
+                raise JSONDecodeError('Expecting \',\' delimiter', text, idx)
+
+    _check_end(text, idx)
+    return items
+
+
+def encode_object(obj, original, text, spans):
+    """
+    Encode a JSON object transformed from one decoded by `decode_object()` or `decode_logs()`
+
+    Members whose values are unchanged (i.e. are the same objects) since decoding are copied from the
+    original `text`, rather than being re-encoded. If the object itself is unchanged, the original
+    `text` is returned as is.
+
+    The result never contains newlines, so can be used in Elasticsearch `_bulk` bodies.
+    """
+
+    if obj is original:
+        encoded = text.strip()
+
+    else:
+        members = []
+        for key, value in obj.items():
+            span = spans.get(key)
+            if span is not None and original.get(key) is value:
+                members.append(text[span[0]:span[1]])
+            else:
+                members.append(f'{json.dumps(key)}:{json.dumps(value, separators=(",", ":"))}')
+
+        encoded = '{' + ','.join(members) + '}'
+
+    # Newlines can only be whitespace between tokens in valid JSON, so are safe to replace.
+    if '\n' in encoded:
+        encoded = encoded.replace('\n', ' ')
+
+    return encoded
@@ -3,12 +3,20 @@ import json
 import rfc3339
 
 from base64 import urlsafe_b64encode
+from functools import lru_cache, partial
+from itertools import islice
 
 
 HASH_BYTES = 16
+CONVERT_TS_CACHE_SIZE = 4096
 CONVERT_TS_PATHS = ['service.created_at', 'service.updated_at',
                     'route.created_at', 'route.updated_at',
                     'started_at', 'tries[].balancer_start']
+# Top level log fields that are identical for all requests to a given service/route, so their
+# transformed values can be cached.
+CACHEABLE_FIELDS = ['service', 'route']
+# Key that entries dropped by a frequent keys limit are folded into.
+OVERFLOW_KEY = '_overflow'
 
 
 def update_path(dct, path, update):
@@ -24,7 +32,8 @@ def update_path(dct, path, update):
     new value.
 
     Dicts and lists along the path are copied before being updated, and the updated dict structure
-    is returned.
+    is returned. If the update doesn't change a dict's value (i.e. returns the same object), the dict
+    is returned as is, rather than being copied.
     """
 
     if not isinstance(dct, dict):
@@ -63,17 +72,58 @@ def update_path(dct, path, update):
         else:
             updated_value = update_fn(value)
 
+    if updated_value is value:
+        return dct
+
     updated_dct = dct.copy()
     updated_dct[field] = updated_value
     return updated_dct
 
 
+def get_path(dct, path):
+    """
+    Get a value from a dict structure (e.g. JSON), using a path to specify what value to get.
+
+    Paths are specified as for `update_path()`. Where the path iterates a list, a list of the values
+    found for each item is returned. `None` is returned if the path doesn't match a value.
+    """
+
+    if not isinstance(dct, dict):
+        return None
+
+    field, sub_path = path.split('.', 1) if '.' in path else (path, None)
+
+    array_field = False
+    if field.endswith('[]'):
+        field = field[:-2]
+        array_field = True
+
+    value = dct.get(field)
+
+    if array_field:
+        if not isinstance(value, list):
+            return None
+
+        if sub_path:
+            return [get_path(v, sub_path) for v in value]
+        else:
+            return value
+
+    if sub_path:
+        return get_path(value, sub_path)
+    else:
+        return value
+
+
+@lru_cache(maxsize=CONVERT_TS_CACHE_SIZE, typed=True)
 def convert_ts(ts):
     """
     Convert a UNIX timestamp to a RFC3339 datetime string
 
     If the timestamp is greater than 99,999,999,999 (5138-11-16T09:46:39+00:00) it's assumed to be
     in milliseconds rather than seconds.
+
+    Timestamps are often repeated (e.g. service/route timestamps), so recent conversions are cached.
     """
 
     if ts is None:
@@ -101,18 +151,7 @@ def convert_qs_bool(qs_dict):
     return qs_dict
 
 
-def hash_value(value, digest_size=HASH_BYTES):
-    """
-    Hash a string with blake2b, and encode as a URL safe base64 string
-
-    If `value` is an int/float, it will be automatically converted to a string using str().
-
-    If `value` is a list/dict, it will be automatically converted to a compact JSON string.
-    """
-
-    if value is None:
-        return None
-
+def _hash_input(value):
     if isinstance(value, str):
         # Strings can be hashed unchanged
         pass
@@ -123,63 +162,142 @@ def hash_value(value, digest_size=HASH_BYTES):
     else:
         raise NotImplementedError(f'Can\'t hash value of type {type(value).__name__}')
 
-    value_bytes = value.encode('utf-8')
-    hash_bytes = hashlib.blake2b(value_bytes, digest_size=digest_size).digest()
-    return urlsafe_b64encode(hash_bytes).decode('utf-8').replace('=', '')
+    return value.encode('utf-8')
+
+
+class Hasher:
+    """
+    Hashes values with blake2b, optionally keyed, and encodes them as URL safe base64 strings
+
+    Values are converted to strings as described for `hash_value()`. With a `key` (up to 64 bytes),
+    blake2b's keyed mode is used, so hashes can't be reversed by brute force without the key. The
+    (keyed) blake2b state is prepared once, and copied for each value hashed.
+    """
+
+    def __init__(self, key=None, digest_size=HASH_BYTES):
+        self._state = hashlib.blake2b(key=key or b'', digest_size=digest_size)
 
+    def __call__(self, value):
+        """Hash a single value, returning `None` if the value is `None`"""
 
-def hash_authorization(value):
+        if value is None:
+            return None
+
+        state = self._state.copy()
+        state.update(_hash_input(value))
+        return urlsafe_b64encode(state.digest()).decode('utf-8').rstrip('=')
+
+    def hash_many(self, values):
+        """
+        Hash a sequence of values, returning a list of hashes in the same order
+
+        Repeated values are only hashed once.
+        """
+
+        copy_state = self._state.copy
+        hashes = {}
+        results = []
+
+        for value in values:
+            if value is None:
+                results.append(None)
+                continue
+
+            value_bytes = _hash_input(value)
+            value_hash = hashes.get(value_bytes)
+            if value_hash is None:
+                state = copy_state()
+                state.update(value_bytes)
+                value_hash = urlsafe_b64encode(state.digest()).decode('utf-8').rstrip('=')
+                hashes[value_bytes] = value_hash
+
+            results.append(value_hash)
+
+        return results
+
+
+DEFAULT_HASHER = Hasher()
+
+
+def hash_value(value, digest_size=HASH_BYTES):
+    """
+    Hash a string with blake2b, and encode as a URL safe base64 string
+
+    If `value` is an int/float, it will be automatically converted to a string using str().
+
+    If `value` is a list/dict, it will be automatically converted to a compact JSON string.
+    """
+
+    if digest_size == HASH_BYTES:
+        return DEFAULT_HASHER(value)
+    else:
+        return Hasher(digest_size=digest_size)(value)
+
+
+def hash_authorization(value, hasher=DEFAULT_HASHER):
     """ Hash the credentials of a Authorization header, or list of Authorization headers"""
 
     if value is None:
         return None
 
     if isinstance(value, list):
-        return [hash_authorization(authorization) for authorization in value]
+        return [hash_authorization(authorization, hasher) for authorization in value]
 
     if ' ' not in value:
-        return hash_value(value)
+        return hasher(value)
 
     auth_type, credentials = value.split(' ', 1)
-    return f'{auth_type} {hash_value(credentials)}'
+    return f'{auth_type} {hasher(credentials)}'
 
 
-def _hash_cookie(value):
+def _hash_cookie(value, hasher):
     if '=' not in value:
-        return hash_value(value)
+        return hasher(value)
 
     cookie_name, cookie_value = value.split('=', 1)
-    return f'{cookie_name}={hash_value(cookie_value)}'
+    return f'{cookie_name}={hasher(cookie_value)}'
 
 
-def hash_cookies(value):
+def hash_cookies(value, hasher=DEFAULT_HASHER):
     """Hash the cookie value of each cookie in a Cookie header, or list of Cookie headers"""
 
     if value is None:
         return None
 
     if isinstance(value, list):
-        return [hash_cookies(cookies) for cookies in value]
+        return [hash_cookies(cookies, hasher) for cookies in value]
+
+    names = []
+    cookie_values = []
+    for cookie in value.split('; '):
+        if '=' in cookie:
+            cookie_name, cookie_value = cookie.split('=', 1)
+            names.append(f'{cookie_name}=')
+        else:
+            cookie_value = cookie
+            names.append('')
+        cookie_values.append(cookie_value)
 
-    cookies = value.split('; ')
-    return '; '.join(_hash_cookie(cookie) for cookie in cookies)
+    # Hash all the cookie values in one go.
+    return '; '.join(name + value_hash
+                     for name, value_hash in zip(names, hasher.hash_many(cookie_values)))
 
 
-def hash_set_cookie(value):
+def hash_set_cookie(value, hasher=DEFAULT_HASHER):
     """Hash the cookie value of each cookie in a Set-Cookie header, or list of Set-Cookie headers"""
 
     if value is None:
         return None
 
     if isinstance(value, list):
-        return [hash_set_cookie(set_cookie) for set_cookie in value]
+        return [hash_set_cookie(set_cookie, hasher) for set_cookie in value]
 
     if '; ' in value:
         cookie, cookie_options = value.split('; ', 1)
-        return f'{_hash_cookie(cookie)}; {cookie_options}'
+        return f'{_hash_cookie(cookie, hasher)}; {cookie_options}'
 
     else:
-        return _hash_cookie(value)
+        return _hash_cookie(value, hasher)
 
 
 def limit_dict(limit):
@@ -190,16 +308,226 @@ def limit_dict(limit):
         if value is None:
             return None
 
-        dict_keys = list(value.keys())
-        if len(dict_keys) <= limit:
+        if len(value) <= limit:
             return value
 
-        limited_dict_keys = dict_keys[:limit]
-        return {k: v for k, v in value.items() if k in limited_dict_keys}
+        return dict(islice(value.items(), limit))
 
     return do_limit_dict
 
 
+def limit_dict_frequent(frequent_keys):
+    """
+    Limit the entries in a dictionary to those with the most frequently seen keys
+
+    Key frequencies are tracked across calls by `frequent_keys` (a `FrequentKeys`). Other entries are
+    folded into a compact JSON string in the `_overflow` entry, so they're kept without each
+    creating a separate field.
+    """
+
+    def do_limit_dict_frequent(value):
+
+        if not isinstance(value, dict):
+            return value
+
+        frequent_keys.observe(value)
+        top_keys = frequent_keys.top_keys
+
+        if all(k in top_keys for k in value):
+            return value
+
+        limited = {}
+        overflow = {}
+        for k, v in value.items():
+            if k in top_keys:
+                limited[k] = v
+            else:
+                overflow[k] = v
+
+        limited[OVERFLOW_KEY] = json.dumps(overflow, separators=(',', ':'))
+        return limited
+
+    return do_limit_dict_frequent
+
+
+def compile_value_limits(max_value_bytes=None, path_limits=None):
+    """
+    Compile limits on the size of string values into a tree, for use with `truncate_values()`
+
+    `max_value_bytes` is the default limit for all values, and `path_limits` a dict mapping paths
+    (as for `update_path()`) to limits overriding it for the value at that path, and any values
+    nested within it. A limit of `0` disables truncation.
+    """
+
+    root = {'limit': max_value_bytes or 0, 'children': {}}
+
+    for path, limit in (path_limits or {}).items():
+        node = root
+        for field in path.split('.'):
+            steps = [field[:-2], '[]'] if field.endswith('[]') else [field]
+            for step in steps:
+                node = node['children'].setdefault(step, {'limit': None, 'children': {}})
+
+        node['limit'] = limit
+
+    return root
+
+
+def _truncate_string(value, limit, hasher):
+    # A UTF-8 character is at most 4 bytes, so short strings can skip encoding.
+    if len(value) * 4 <= limit:
+        return value
+
+    value_bytes = value.encode('utf-8')
+    if len(value_bytes) <= limit:
+        return value
+
+    suffix = f'...{hasher(value)}' if hasher else ''
+    # Fall back to plain truncation if the limit doesn't leave room for any of the value.
+    if len(suffix) >= limit:
+        suffix = ''
+    keep_bytes = limit - len(suffix)
+    # Drop any partial character left at the end.
+    return value_bytes[:keep_bytes].decode('utf-8', 'ignore') + suffix
+
+
+def truncate_values(value, value_limits, hasher=None):
+    """
+    Truncate string values in a dict structure (e.g. JSON) that are over their size limit, in bytes
+
+    Limits are specified by a tree from `compile_value_limits()`. If a `hasher` is provided, a hash
+    of each full value is appended to its truncated value, after `...`, unless the limit is too
+    small to fit it.
+
+    The structure is traversed once, and dicts and lists are only copied if they contain a truncated
+    value. Returns the updated structure, and the number of values truncated.
+    """
+
+    truncated_count = 0
+
+    def truncate(value, node, limit):
+        nonlocal truncated_count
+
+        if node is not None and node['limit'] is not None:
+            limit = node['limit']
+        children = node['children'] if node is not None else None
+
+        if isinstance(value, str):
+            if not limit:
+                return value
+
+            truncated = _truncate_string(value, limit, hasher)
+            if truncated is not value:
+                truncated_count += 1
+            return truncated
+
+        elif isinstance(value, dict):
+            updated = None
+            for k, v in value.items():
+                child = children.get(k) if children else None
+                # Skip values that can't have anything to truncate.
+                if child is None and not limit:
+                    continue
+
+                updated_v = truncate(v, child, limit)
+                if updated_v is not v:
+                    if updated is None:
+                        updated = value.copy()
+                    updated[k] = updated_v
+
+            return value if updated is None else updated
+
+        elif isinstance(value, list):
+            child = children.get('[]') if children else None
+            if child is None and not limit:
+                return value
+
+            updated = [truncate(v, child, limit) for v in value]
+            if any(u is not v for u, v in zip(updated, value)):
+                return updated
+            return value
+
+        else:
+            return value
+
+    return truncate(value, value_limits, None), truncated_count
+
+
+def is_sub_path(path, field):
+    """Check if a path is for a top level field, or a field nested within it"""
+
+    return path == field or path.startswith(f'{field}.') or path.startswith(f'{field}[]')
+
+
+def sub_object_cache_key(field, value):
+    """
+    Get the cache key for a cacheable top level object (e.g. `service`) in a log
+
+    Objects are identified by their `id` and `updated_at` fields. Returns `None` if the object can't
+    be cached.
+    """
+
+    if not isinstance(value, dict):
+        return None
+
+    obj_id = value.get('id')
+    updated_at = value.get('updated_at')
+    if not isinstance(obj_id, str) or not isinstance(updated_at, (str, int, float)):
+        return None
+
+    return (field, obj_id, updated_at)
+
+
+# Cached in place of a transformed object when the transformation doesn't change it, so logs keep
+# their own (identical) object, and it can be serialized as is.
+_UNCHANGED = object()
+
+
+def _transform_cached_fields(log, cache, ts_paths, hash_paths, null_paths, hasher):
+    cached_fields = []
+    copied = False
+
+    for field in CACHEABLE_FIELDS:
+        field_ts_paths = [path for path in ts_paths if is_sub_path(path, field)]
+        field_hash_paths = [path for path in hash_paths if is_sub_path(path, field)]
+        field_null_paths = [path for path in null_paths if is_sub_path(path, field)]
+        # Nothing to transform, so nothing worth caching.
+        if not (field_ts_paths or field_hash_paths or field_null_paths):
+            continue
+
+        cache_key = sub_object_cache_key(field, log.get(field))
+        if cache_key is None:
+            continue
+
+        value = cache.get(cache_key)
+        if value is None:
+            sub_log = {field: log[field]}
+
+            for path in field_ts_paths:
+                sub_log = update_path(sub_log, path, convert_ts)
+
+            for path in field_hash_paths:
+                sub_log = update_path(sub_log, path, hasher)
+
+            for path in field_null_paths:
+                sub_log = update_path(sub_log, path, None)
+
+            value = sub_log[field]
+            cache.put(cache_key, _UNCHANGED if value is log[field] else value)
+
+        elif value is _UNCHANGED:
+            value = log[field]
+
+        if value is not log[field]:
+            if not copied:
+                log = log.copy()
+                copied = True
+            log[field] = value
+        cached_fields.append(field)
+
+    return log, cached_fields
+
+
 def transform_log(log,
                   do_convert_ts=False,
                   do_convert_qs_bools=False,
@@ -210,14 +538,54 @@ def transform_log(log,
                   null_paths=None,
                   limit_request_headers=None,
                   limit_request_querystring=None,
-                  expose_ips=None):
+                  expose_ips=None,
+                  sub_object_cache=None,
+                  request_headers_keys=None,
+                  request_querystring_keys=None,
+                  hasher=DEFAULT_HASHER,
+                  value_limits=None,
+                  hash_truncated_values=False):
+    """
+    Transform a log, as configured by the options
+
+    If a `sub_object_cache` (e.g. an `LRUCache`) is provided, the transformed values of top level
+    objects that are identical across requests (e.g. `service` and `route`) are stored in it, and
+    reused for subsequent logs containing the same objects. Cached values must not be modified.
+
+    If `request_headers_keys`/`request_querystring_keys` (`FrequentKeys`) are provided, the request
+    headers/querystring are limited to their most frequently seen keys, rather than the first
+    `limit_request_headers`/`limit_request_querystring` keys.
+
+    Values are hashed with `hasher`, which defaults to an unkeyed `Hasher`.
+
+    If `value_limits` (from `compile_value_limits()`) are provided, oversized string values are
+    truncated, optionally with a hash of the full value appended, and the number truncated is added
+    to the log as `truncated_values`.
+    """
 
     if expose_ips is None:
         expose_ips = []
 
-    if convert_ts:
-        for path in CONVERT_TS_PATHS:
-            log = update_path(log, path, convert_ts)
+    ts_paths = CONVERT_TS_PATHS if do_convert_ts else []
+    hash_paths = hash_paths or []
+    null_paths = null_paths or []
+
+    if sub_object_cache is not None:
+        log, cached_fields = _transform_cached_fields(log, sub_object_cache,
+                                                      ts_paths, hash_paths, null_paths, hasher)
+
+        # Cached fields have already been transformed, so skip them from here on.
+        if cached_fields:
+            def uncached(paths):
+                return [path for path in paths
+                        if not any(is_sub_path(path, field) for field in cached_fields)]
+
+            ts_paths = uncached(ts_paths)
+            hash_paths = uncached(hash_paths)
+            null_paths = uncached(null_paths)
+
+    for path in ts_paths:
+        log = update_path(log, path, convert_ts)
 
     if do_convert_qs_bools:
         log = update_path(log, 'request.querystring', convert_qs_bool)
@@ -226,7 +594,7 @@ def transform_log(log,
         # Extract client IP in case we need to expose it later.
         client_ip = log.get('client_ip')
 
-        log = update_path(log, 'client_ip', hash_value)
+        log = update_path(log, 'client_ip', hasher)
 
         if client_ip:
             # Check if IP hash is in the exposure list.
@@ -235,24 +603,100 @@ def transform_log(log,
                 log['raw_client_ip'] = client_ip
 
     if do_hash_auth:
-        log = update_path(log, 'request.headers.authorization', hash_authorization)
+        log = update_path(log, 'request.headers.authorization',
+                          partial(hash_authorization, hasher=hasher))
 
     if do_hash_cookie:
-        log = update_path(log, 'request.headers.cookie', hash_cookies)
-        log = update_path(log, 'response.headers.set-cookie', hash_set_cookie)
+        log = update_path(log, 'request.headers.cookie', partial(hash_cookies, hasher=hasher))
+        log = update_path(log, 'response.headers.set-cookie',
+                          partial(hash_set_cookie, hasher=hasher))
 
-    if hash_paths:
-        for path in hash_paths:
-            log = update_path(log, path, hash_value)
+    for path in hash_paths:
+        log = update_path(log, path, hasher)
 
-    if null_paths:
-        for path in null_paths:
-            log = update_path(log, path, None)
+    for path in null_paths:
+        log = update_path(log, path, None)
 
-    if limit_request_headers is not None:
+    if request_headers_keys is not None:
+        log = update_path(log, 'request.headers', limit_dict_frequent(request_headers_keys))
+    elif limit_request_headers is not None:
         log = update_path(log, 'request.headers', limit_dict(limit_request_headers))
 
-    if limit_request_querystring is not None:
+    if request_querystring_keys is not None:
+        log = update_path(log, 'request.querystring', limit_dict_frequent(request_querystring_keys))
+    elif limit_request_querystring is not None:
         log = update_path(log, 'request.querystring', limit_dict(limit_request_querystring))
 
+    if value_limits is not None:
+        log, truncated_count = truncate_values(log, value_limits,
+                                               hasher if hash_truncated_values else None)
+        if truncated_count:
+            # The log has been copied, as it had values truncated, so can be updated directly.
+            log['truncated_values'] = truncated_count
+
     return log
+
+
+class _BatchHasher:
+    """
+    Wraps a `Hasher`, remembering the hashes of scalar values so repeated values are only hashed
+    once.
+
+    Hashes can be calculated up front for a column of values with `hash_column()`.
+    """
+
+    def __init__(self, hasher):
+        self._hasher = hasher
+        # Keyed by type as well as value, as e.g. 1 and 1.0 are equal, but hash differently.
+        self._hashes = {}
+
+    def hash_column(self, values):
+        unique = {(type(v), v) for v in values if isinstance(v, (str, int, float))}
+        unique = [key for key in unique if key not in self._hashes]
+        hashes = self._hasher.hash_many([v for _, v in unique])
+        self._hashes.update(zip(unique, hashes))
+
+    def __call__(self, value):
+        if not isinstance(value, (str, int, float)):
+            return self._hasher(value)
+
+        key = (type(value), value)
+        value_hash = self._hashes.get(key)
+        if value_hash is None:
+            value_hash = self._hasher(value)
+            self._hashes[key] = value_hash
+        return value_hash
+
+    def hash_many(self, values):
+        return [self(value) for value in values]
+
+
+def _flatten(value):
+    # Flatten the nested lists of values `get_path()` returns for paths iterating lists.
+    if isinstance(value, list):
+        for v in value:
+            yield from _flatten(v)
+    else:
+        yield value
+
+
+def transform_logs(logs, hasher=DEFAULT_HASHER, **kwargs):
+    """
+    Transform a batch of logs, giving the same results as calling `transform_log()` on each log
+
+    Values to hash at fixed paths (the client IP and hash paths) are first pulled out of all the
+    logs into columns, and each unique value is hashed once, in one pass. Other hashed values (e.g.
+    cookies) are also only hashed once per unique value across the batch. The logs are then
+    transformed with these hashes.
+    """
+
+    batch_hasher = _BatchHasher(hasher)
+
+    hash_column_paths = list(kwargs.get('hash_paths') or [])
+    if kwargs.get('do_hash_ip'):
+        hash_column_paths.append('client_ip')
+
+    for path in hash_column_paths:
+        batch_hasher.hash_column([v for log in logs for v in _flatten(get_path(log, path))])
+
+    return [transform_log(log, hasher=batch_hasher, **kwargs) for log in logs]
@@ -0,0 +1,106 @@
+import gevent
+import logging
+
+from elasticsearch import ConnectionError, TransportError
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+# Timeout for each request made to open a connection, in seconds.
+WARM_UP_REQUEST_TIMEOUT_S = 10
+
+# How long to wait between attempts to open connections, in seconds.
+WARM_UP_RETRY_INTERVAL_S = 1
+
+
+def connection_check_result(connection, error=None):
+    """
+    Whether a request to an Elasticsearch node over a connection succeeded, given the error it
+    raised, if any.
+
+    Error responses (e.g. for a user without access to the `HEAD /` endpoint) still count as
+    successful, as they show the node can be reached and the connection has been opened.
+    """
+
+    if isinstance(error, ConnectionError):
+        log.debug('Failed to connect to Elasticsearch node %(node)s.',
+                  {'node': connection.host}, exc_info=error)
+        return False
+    if isinstance(error, TransportError):
+        log.debug('Elasticsearch node %(node)s responded with status %(status)s.',
+                  {'node': connection.host, 'status': error.status_code})
+
+    return True
+
+
+def check_es_connection(connection, timeout):
+    """Make a request to an Elasticsearch node over a connection, returning whether it succeeded."""
+
+    try:
+        connection.perform_request('HEAD', '/', timeout=timeout)
+    except TransportError as e:
+        return connection_check_result(connection, e)
+
+    return connection_check_result(connection)
+
+
+class WarmUpAttempts:
+    """
+    Tracks attempts to open connections to Elasticsearch, retrying until `timeout_s` seconds have
+    passed. Shared by the gevent and asyncio warm ups, which run the checks concurrently themselves.
+    """
+
+    def __init__(self, timeout_s):
+        self.deadline = monotonic() + timeout_s
+
+    def request_timeout(self):
+        """The timeout for each request of the next attempt, in seconds."""
+
+        return max(min(self.deadline - monotonic(), WARM_UP_REQUEST_TIMEOUT_S), 0.1)
+
+    def finish(self, results):
+        """
+        Record the results of an attempt's connection checks.
+
+        Returns `True` if they all succeeded, `False` if some failed and there's no time left to
+        retry, or `None` if the caller should wait `retry_delay()` seconds and retry.
+        """
+
+        failed = results.count(False)
+        if not failed:
+            return True
+
+        log.warning('Failed to open %(failed)d of %(count)d connections to Elasticsearch.',
+                    {'failed': failed, 'count': len(results)})
+
+        if self.deadline - monotonic() <= 0:
+            return False
+        return None
+
+    def retry_delay(self):
+        """How long to wait before the next attempt, in seconds."""
+
+        return max(min(self.deadline - monotonic(), WARM_UP_RETRY_INTERVAL_S), 0)
+
+
+def warm_es_connections(es_client, connections, timeout_s):
+    """
+    Open `connections` connections to each node of an Elasticsearch client, and check they work.
+
+    The connections are opened concurrently, so the client's connection pool to each node holds
+    that many connections afterwards, ready to reuse. Retries until all the connections work, or
+    `timeout_s` seconds have passed. Returns whether all the connections work.
+    """
+
+    attempts = WarmUpAttempts(timeout_s)
+    while True:
+        timeout = attempts.request_timeout()
+        greenlets = [gevent.spawn(check_es_connection, connection, timeout)
+                     for connection in es_client.transport.connection_pool.connections
+                     for _ in range(connections)]
+        gevent.joinall(greenlets)
+
+        finished = attempts.finish([bool(greenlet.value) for greenlet in greenlets])
+        if finished is not None:
+            return finished
+        gevent.sleep(attempts.retry_delay())
@@ -1,20 +1,68 @@
-from gevent import monkey; monkey.patch_all()
+import os
+import sys
+import time
+
+# Startup time is reported from here, so it includes as much of the import time as possible.
+START_TIME = time.perf_counter()
+
+
+def engine_option():
+    """
+    Find the value of the --engine option, before the CLI options are parsed.
+
+    The gevent engine requires the standard library to be monkey patched before anything else is
+    imported, so the engine in use needs to be known up front.
+    """
+
+    engine = os.environ.get('KONG_LOG_BRIDGE_OPT_ENGINE', 'gevent')
 
+    args = sys.argv[1:]
+    for i, arg in enumerate(args):
+        if arg == '--engine' and i + 1 < len(args):
+            engine = args[i + 1]
+        elif arg.startswith('--engine='):
+            engine = arg.split('=', 1)[1]
+
+    return engine
+
+
+if engine_option() != 'asyncio':
+    from gevent import monkey; monkey.patch_all()
+
+    # The Elasticsearch client imports its async client, and so aiohttp, whenever aiohttp is
+    # installed. The gevent engine doesn't use them, so skip importing them to speed up startup.
+    # Blocking the import with a `None` entry only lasts while the client is first imported, so
+    # aiohttp can still be imported later if anything else needs it.
+    _aiohttp_module = sys.modules.get('aiohttp')
+    sys.modules['aiohttp'] = None
+    try:
+        import elasticsearch  # noqa: F401
+    finally:
+        if _aiohttp_module is None:
+            del sys.modules['aiohttp']
+        else:
+            sys.modules['aiohttp'] = _aiohttp_module
+
+import asyncio
 import bottle
 import click
 import gevent
 import kong_log_bridge
 import logging
-import sys
-import time
+import signal
 
 from elasticsearch import Elasticsearch
+from gevent.event import Event
 from gevent.pool import Pool
 
 from utils import log_exceptions, nice_shutdown
-from utils.logging import configure_logging, wsgi_log_middleware
+from utils.logging import StageTimer, configure_logging, wsgi_log_middleware
 
 from kong_log_bridge import construct_app
+from kong_log_bridge.bulk import BulkIndexer
+from kong_log_bridge.processor import LogProcessor, ReloadableLogProcessor
+from kong_log_bridge.sinks import ElasticsearchSink, FileSink
+from kong_log_bridge.warmup import warm_es_connections
 
 CONTEXT_SETTINGS = {
     'help_option_names': ['-h', '--help']
@@ -28,6 +76,9 @@ gevent_pool = Pool()
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--max-body-bytes', default=102_400,
+              help='Reject requests with bodies larger than this many bytes, with a 413 response. '
+                   '(default=102400)')
 @click.option('--convert-ts', default=False, is_flag=True,
               help='Convert UNIX timestamps to RFC3339 datetime strings.')
 @click.option('--convert-qs-bools', default=False, is_flag=True,
@@ -38,6 +89,12 @@ gevent_pool = Pool()
               help='Hash the Authorization request header.')
 @click.option('--hash-cookie', default=False, is_flag=True,
               help='Hash the Cookie request header and Set-Cookie response header.')
+@click.option('--hash-key',
+              help='Secret key to hash values with, using keyed blake2b hashing. Up to 64 bytes. '
+                   'If not specified, values are hashed without a key.')
+@click.option('--hash-key-file',
+              help='Path to a file containing the secret key to hash values with. '
+                   'Can be used instead of --hash-key.')
 @click.option('--hash-path', multiple=True,
               help='A path to a field to hash. '
                    'Specify multiple paths by providing the option multiple times.')
@@ -48,15 +105,108 @@ gevent_pool = Pool()
               help='Limit the number of request headers (default=100)')
 @click.option('--limit-request-querystring', default=100,
               help='Limit the number of request querystring parameters (default=100)')
+@click.option('--limit-keys-by', default='arrival', type=click.Choice(['arrival', 'frequency']),
+              help='How to choose which request header and querystring keys to keep when limiting '
+                   'them. "arrival" keeps the first keys in each request, "frequency" keeps the keys '
+                   'seen most frequently across all requests. (default=arrival)')
+@click.option('--max-value-bytes', default=0,
+              help='Truncate string values longer than this many bytes (UTF-8). '
+                   '(default=0 i.e. no limit)')
+@click.option('--max-value-bytes-path', multiple=True,
+              help='Override --max-value-bytes for the value at a path, and values nested within it, '
+                   'in the form <path>=<bytes> e.g. request.headers.referer=256. '
+                   'A limit of 0 disables truncation. '
+                   'Specify multiple paths by providing the option multiple times.')
+@click.option('--hash-truncated-values', default=False, is_flag=True,
+              help='Append a hash of the full value to truncated values.')
+@click.option('--sub-object-cache-size', default=1024,
+              help='Number of transformed service and route objects to cache. '
+                   '0 disables caching. (default=1024)')
 @click.option('--expose-ip', multiple=True,
               help='Hash of an IP to expose i.e. include the raw IP in logs. '
                    'Specify multiple IP hashes by providing the option multiple times.')
+@click.option('--config-file',
+              help='Path to a JSON file of transformation options, which override the CLI options. '
+                   'The file is reloaded on SIGHUP, or when it changes. See the README for the '
+                   'options that can be set.')
+@click.option('--config-reload-interval', default=5.0,
+              help='How often to check if the config file has changed, in seconds. '
+                   '(default=5, 0 disables checking)')
+@click.option('--quota-key-path', multiple=True,
+              help='A path to a field to apply ingest quotas to each value of, e.g. service.name. '
+                   'Specify multiple paths by providing the option multiple times.')
+@click.option('--quota-rate', default=0.0,
+              help='Maximum rate of logs per second for each quota key value. '
+                   '(default=0 i.e. no quotas)')
+@click.option('--quota-burst', default=0.0,
+              help='Maximum burst of logs for each quota key value. At least 1. '
+                   '(default=--quota-rate, or 1 if that\'s less than 1)')
+@click.option('--quota-max-keys', default=100_000,
+              help='Maximum number of quota key values to track. '
+                   'The least recently seen values are forgotten first. (default=100000)')
+@click.option('--quota-sample-rate', default=0.0, type=click.FloatRange(0, 1),
+              help='Proportion of over quota logs to keep. (default=0)')
+@click.option('--quota-summary-interval', default=60.0,
+              help='How often to index summaries of over quota logs, in seconds. (default=60)')
 @click.option('--es-node', '-e', required=True, multiple=True,
               help='Address of a node in a Elasticsearch cluster to send logs to. '
                    'Specify multiple nodes by providing the option multiple times. '
                    'A port can be provided if non-standard (9200) e.g. es1:9999.')
 @click.option('--es-index', default='<kong-requests-{now/d}>',
               help='Elasticsearch Kong request log index. (default=<kong-requests-{now/d}>)')
+@click.option('--es-id-path', multiple=True,
+              help='A path to a field to derive Elasticsearch document IDs from, '
+                   'e.g. request.headers.x-kong-request-id. '
+                   'Specify multiple paths by providing the option multiple times. '
+                   'If not specified, Elasticsearch generates document IDs.')
+@click.option('--dedup-window', default=0,
+              help='How many seconds to remember document IDs for, to drop duplicate logs '
+                   'before they\'re sent to Elasticsearch. Requires --es-id-path. '
+                   '(default=0 i.e. disabled)')
+@click.option('--dedup-memory', default=1024,
+              help='Memory budget for remembering document IDs, in KiB. (default=1024)')
+@click.option('--dedup-fp-rate', default=0.001,
+              help='Maximum rate of logs falsely identified as duplicates. (default=0.001)')
+@click.option('--es-bulk-interval', default=0.0,
+              help='Buffer logs and index them in bulk at this interval, in seconds. '
+                   '(default=0 i.e. index each log individually)')
+@click.option('--es-bulk-size', default=5_242_880,
+              help='Index buffered logs as soon as they reach this size, in bytes. '
+                   '(default=5242880 i.e. 5MiB)')
+@click.option('--es-buffer-max-size', default=52_428_800,
+              help='Maximum size of buffered logs, in bytes. '
+                   'Logs received when the buffer is full are rejected. '
+                   '(default=52428800 i.e. 50MiB)')
+@click.option('--es-mirror-node', multiple=True,
+              help='Address of a node in a second Elasticsearch cluster to also send logs to. '
+                   'Specify multiple nodes by providing the option multiple times. '
+                   'Uses the same security options as --es-node.')
+@click.option('--es-mirror-index',
+              help='Elasticsearch index to send logs to in the second cluster. '
+                   '(default=--es-index)')
+@click.option('--file-sink-dir',
+              help='Directory to also write logs to, as gzip compressed JSON lines files.')
+@click.option('--file-sink-max-size', default=104_857_600,
+              help='Start a new file once the current one reaches this (compressed) size, '
+                   'in bytes. (default=104857600 i.e. 100MiB)')
+@click.option('--file-sink-max-age', default=3600.0,
+              help='Start a new file once the current one is this old, in seconds. (default=3600)')
+@click.option('--sink-interval', default=1.0,
+              help='How often to send batches of logs to the second Elasticsearch cluster and '
+                   'files, in seconds. (default=1)')
+@click.option('--sink-batch-size', default=5_242_880,
+              help='Send a batch of logs to the second Elasticsearch cluster and files as soon as it '
+                   'reaches this size, in bytes. (default=5242880 i.e. 5MiB)')
+@click.option('--sink-queue-max-size', default=52_428_800,
+              help='Maximum size of logs queued for each of the second Elasticsearch cluster and '
+                   'files, in bytes. Logs are dropped for a destination when its queue is full. '
+                   '(default=52428800 i.e. 50MiB)')
+@click.option('--sink-workers', default=2,
+              help='Number of batches to send to the second Elasticsearch cluster concurrently. '
+                   '(default=2)')
+@click.option('--sink-retries', default=3,
+              help='Number of times to retry sending a batch of logs to the second Elasticsearch '
+                   'cluster or files, before dropping it. (default=3)')
 @click.option('--es-ca-certs',
               help='Path to a CA certificate bundle. '
                    'Can be absolute, or relative to the current working directory. '
@@ -77,6 +227,11 @@ gevent_pool = Pool()
                    'Must be specified if "--es-basic-user" is provided.')
 @click.option('--es-max-connections', default=10,
               help='Maximum simultaneous connections to Elasticsearch. (default=10)')
+@click.option('--startup-timeout', default=30.0,
+              help='How long to wait for connections to Elasticsearch to be opened and checked '
+                   'at startup before reporting ready anyway, in seconds. (default=30)')
+@click.option('--engine', default='gevent', type=click.Choice(['gevent', 'asyncio']),
+              help='Server engine to use. The asyncio engine requires aiohttp. (default=gevent)')
 @click.option('--port', '-p', default=8080,
               help='Port to serve API on (default=8080)')
 @click.option('--shutdown-sleep', default=10,
@@ -84,6 +239,9 @@ gevent_pool = Pool()
 @click.option('--shutdown-wait', default=10,
               help='How many seconds to wait for active connections to close during graceful '
                    'shutdown (after sleeping). (default=10)')
+@click.option('--timing-sample-rate', default=1.0, type=click.FloatRange(0, 1),
+              help='Proportion of requests to include per-stage timings (in microseconds) for '
+                   'in request logs. (default=1.0)')
 @click.option('--json', '-j', default=False, is_flag=True,
               help='Log in json')
 @click.option('--log-level', default='INFO',
@@ -93,26 +251,8 @@ gevent_pool = Pool()
               help='Turn on verbose (DEBUG) logging. Overrides --log-level.')
 @log_exceptions(exit_on_exception=True)
 def main(**options):
-
-    def shutdown():
-        kong_log_bridge.SERVER_READY = False
-
-        def wait():
-            # Sleep for a few seconds to allow for race conditions between sending
-            # the SIGTERM and load balancers stopping sending traffic here.
-            log.info('Shutdown: Sleeping %(sleep_s)s seconds.',
-                     {'sleep_s': options['shutdown_sleep']})
-            time.sleep(options['shutdown_sleep'])
-
-            log.info('Shutdown: Waiting up to %(wait_s)s seconds for connections to close.',
-                     {'wait_s': options['shutdown_sleep']})
-            gevent_pool.join(timeout=options['shutdown_wait'])
-
-            log.info('Shutdown: Exiting.')
-            sys.exit()
-
-        # Run in greenlet, as we can't block in a signal hander.
-        gevent.spawn(wait)
+    startup_timer = StageTimer()
+    startup_timer.timings['imports'] = int((time.perf_counter() - START_TIME) * 1_000_000)
 
     configure_logging(json=options['json'], verbose=options['verbose'],
                       log_level=options['log_level'])
@@ -139,22 +279,186 @@ def main(**options):
     elif not options['es_client_cert'] and options['es_client_key']:
         click.BadOptionUsage('es_client_key', '--es-client-cert must be provided when --es-client-key is used.')
 
+    if options['hash_key'] and options['hash_key_file']:
+        raise click.BadOptionUsage('hash_key', '--hash-key and --hash-key-file can\'t both be used.')
+
+    if options['dedup_window'] and not options['es_id_path']:
+        raise click.BadOptionUsage('dedup_window', '--dedup-window requires --es-id-path.')
+
+    if options['quota_burst'] and options['quota_burst'] < 1:
+        raise click.BadOptionUsage('quota_burst', '--quota-burst must be at least 1.')
+
+    if options['engine'] == 'asyncio' and (options['es_mirror_node'] or options['file_sink_dir']):
+        raise click.BadOptionUsage('engine', '--es-mirror-node and --file-sink-dir are only '
+                                             'supported by the gevent engine.')
+
+    es_kwargs = {
+        'http_auth': http_auth,
+        'maxsize': options['es_max_connections'],
+    }
     if options['es_ca_certs']:
-        es_client = Elasticsearch(options['es_node'],
-                                  verify_certs=True,
-                                  ca_certs=options['es_ca_certs'],
-                                  client_cert=options['es_client_cert'],
-                                  client_key=options['es_client_key'],
-                                  http_auth=http_auth,
-                                  maxsize=options['es_max_connections'])
+        es_kwargs.update({
+            'verify_certs': True,
+            'ca_certs': options['es_ca_certs'],
+            'client_cert': options['es_client_cert'],
+            'client_key': options['es_client_key'],
+        })
     else:
-        es_client = Elasticsearch(options['es_node'],
-                                  verify_certs=False,
-                                  http_auth=http_auth,
-                                  maxsize=options['es_max_connections'])
+        es_kwargs['verify_certs'] = False
+
+    if options['engine'] == 'asyncio':
+        # Equivalent to `asyncio.run()`, which isn't available in Python 3.6.
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(serve_asyncio(es_kwargs, options, startup_timer))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+    else:
+        serve_gevent(es_kwargs, options, startup_timer)
+
+
+def build_log_processor(options):
+    if options['config_file']:
+        return ReloadableLogProcessor(options['config_file'], options)
+    else:
+        return LogProcessor(**options)
+
+
+def log_startup(startup_timer, es_ready):
+    startup_time_ms = int((time.perf_counter() - START_TIME) * 1000)
+    if es_ready:
+        log.info('Startup: Ready in %(startup_time_ms)d ms.',
+                 {'startup_time_ms': startup_time_ms,
+                  'startup_stage_times_us': startup_timer.timings})
+    else:
+        log.warning('Startup: Ready in %(startup_time_ms)d ms, but failed to open all connections '
+                    'to Elasticsearch.',
+                    {'startup_time_ms': startup_time_ms,
+                     'startup_stage_times_us': startup_timer.timings})
+
+
+def serve_gevent(es_kwargs, options, startup_timer):
+
+    shutting_down = Event()
+
+    def shutdown():
+        shutting_down.set()
+        kong_log_bridge.SERVER_READY = False
+
+        def wait():
+            # Sleep for a few seconds to allow for race conditions between sending
+            # the SIGTERM and load balancers stopping sending traffic here.
+            log.info('Shutdown: Sleeping %(sleep_s)s seconds.',
+                     {'sleep_s': options['shutdown_sleep']})
+            time.sleep(options['shutdown_sleep'])
+
+            log.info('Shutdown: Waiting up to %(wait_s)s seconds for connections to close.',
+                     {'wait_s': options['shutdown_sleep']})
+            gevent_pool.join(timeout=options['shutdown_wait'])
+
+            if bulk_indexer:
+                log.info('Shutdown: Indexing buffered logs.')
+                bulk_indexer.stop()
+
+            if sinks:
+                log.info('Shutdown: Sending queued logs to sinks.')
+                # Stop the sinks in parallel, so a slow sink doesn't delay the others.
+                gevent.joinall([gevent.spawn(sink.stop) for sink in sinks])
+
+            log.info('Shutdown: Exiting.')
+            sys.exit()
+
+        # Run in greenlet, as we can't block in a signal hander.
+        gevent.spawn(wait)
+
+    def index_quota_summaries():
+        while True:
+            gevent.sleep(options['quota_summary_interval'])
+            try:
+                convert_ts = log_processor.transform_options['do_convert_ts']
+                for doc in log_processor.quotas.take_summary_documents(convert_ts):
+                    if bulk_indexer:
+                        if not bulk_indexer.add(doc.encode('utf-8')):
+                            log.warning('Dropped a quota summary, as the log buffer is full.')
+                    else:
+                        es_client.index(index=options['es_index'], body=doc, request_timeout=30)
+                    for sink in sinks:
+                        sink.add_many([(None, doc.encode('utf-8'))])
+            except Exception:
+                log.exception('Failed to index quota summaries.')
+
+    es_client = Elasticsearch(options['es_node'], **es_kwargs)
+
+    sink_kwargs = {
+        'interval_s': options['sink_interval'],
+        'batch_bytes': options['sink_batch_size'],
+        'max_queue_bytes': options['sink_queue_max_size'],
+        'retries': options['sink_retries'],
+    }
+    sinks = []
+    if options['es_mirror_node']:
+        sinks.append(ElasticsearchSink(Elasticsearch(options['es_mirror_node'], **es_kwargs),
+                                       options['es_mirror_index'] or options['es_index'],
+                                       name='Elasticsearch mirror',
+                                       workers=options['sink_workers'],
+                                       **sink_kwargs))
+    if options['file_sink_dir']:
+        os.makedirs(options['file_sink_dir'], exist_ok=True)
+        sinks.append(FileSink(options['file_sink_dir'],
+                              max_file_bytes=options['file_sink_max_size'],
+                              max_file_age_s=options['file_sink_max_age'],
+                              name='File',
+                              **sink_kwargs))
+    for sink in sinks:
+        sink.start()
+
+    bulk_indexer = None
+    if options['es_bulk_interval'] > 0:
+        bulk_indexer = BulkIndexer(es_client, options['es_index'],
+                                   interval_s=options['es_bulk_interval'],
+                                   flush_bytes=options['es_bulk_size'],
+                                   max_buffer_bytes=options['es_buffer_max_size'])
+        bulk_indexer.start()
+
+    def reload_config(signum, _):
+        log.info('Received signal %(signal)s. Reloading config file.',
+                 {'signal': signal.Signals(signum).name})
+        # Reload in a greenlet, as we can't block in a signal handler.
+        gevent.spawn(log_processor.reload)
+
+    def watch_config_file():
+        while True:
+            gevent.sleep(options['config_reload_interval'])
+            log_processor.reload_if_changed()
+
+    with startup_timer.time('processor'):
+        log_processor = build_log_processor(options)
+    if log_processor.quotas:
+        gevent.spawn(index_quota_summaries)
+    if options['config_file']:
+        signal.signal(signal.SIGHUP, reload_config)
+        if options['config_reload_interval'] > 0:
+            gevent.spawn(watch_config_file)
 
-    app = construct_app(es_client, **options)
-    app = wsgi_log_middleware(app)
+    app = construct_app(es_client, bulk_indexer=bulk_indexer, log_processor=log_processor,
+                        sinks=sinks, **options)
+    app = wsgi_log_middleware(app, timing_sample_rate=options['timing_sample_rate'])
+
+    def warm_up():
+        # Open connections to Elasticsearch before reporting ready, so the first requests don't
+        # have to wait for them to be opened.
+        with startup_timer.time('es_connections'):
+            es_ready = warm_es_connections(es_client, options['es_max_connections'],
+                                           timeout_s=options['startup_timeout'])
+
+        if not shutting_down.is_set():
+            kong_log_bridge.SERVER_READY = True
+            log_startup(startup_timer, es_ready)
+
+    gevent.spawn(warm_up)
 
     with nice_shutdown(shutdown):
         bottle.run(app,
@@ -164,5 +468,113 @@ def main(**options):
                    quiet=True, error_log=None)
 
 
+async def serve_asyncio(es_kwargs, options, startup_timer):
+    # aiohttp is only required for the asyncio engine, so only import it (and modules using it)
+    # when the engine is used.
+    from aiohttp import web
+    from elasticsearch import AsyncElasticsearch
+    from kong_log_bridge.aio import (AsyncBulkIndexer, construct_aio_app,
+                                     warm_async_es_connections)
+    from utils.aio_logging import aio_log_middleware
+
+    loop = asyncio.get_event_loop()
+    shutting_down = asyncio.Event()
+
+    def shutdown():
+        # Signal handlers run outside the event loop, so hand over to it to do the actual shutdown.
+        loop.call_soon_threadsafe(shutting_down.set)
+
+    async def index_quota_summaries():
+        while True:
+            await asyncio.sleep(options['quota_summary_interval'])
+            try:
+                convert_ts = log_processor.transform_options['do_convert_ts']
+                for doc in log_processor.quotas.take_summary_documents(convert_ts):
+                    if bulk_indexer:
+                        if not bulk_indexer.add(doc.encode('utf-8')):
+                            log.warning('Dropped a quota summary, as the log buffer is full.')
+                    else:
+                        await es_client.index(index=options['es_index'], body=doc,
+                                              request_timeout=30)
+            except Exception:
+                log.exception('Failed to index quota summaries.')
+
+    # The async client keeps up to `maxsize` connections open to each node, and reuses them.
+    es_client = AsyncElasticsearch(options['es_node'], **es_kwargs)
+
+    bulk_indexer = None
+    if options['es_bulk_interval'] > 0:
+        bulk_indexer = AsyncBulkIndexer(es_client, options['es_index'],
+                                        interval_s=options['es_bulk_interval'],
+                                        flush_bytes=options['es_bulk_size'],
+                                        max_buffer_bytes=options['es_buffer_max_size'])
+        bulk_indexer.start()
+
+    def reload_config():
+        log.info('Received signal SIGHUP. Reloading config file.')
+        log_processor.reload()
+
+    async def watch_config_file():
+        while True:
+            await asyncio.sleep(options['config_reload_interval'])
+            log_processor.reload_if_changed()
+
+    with startup_timer.time('processor'):
+        log_processor = build_log_processor(options)
+    if log_processor.quotas:
+        asyncio.ensure_future(index_quota_summaries())
+    if options['config_file']:
+        loop.add_signal_handler(signal.SIGHUP, reload_config)
+        if options['config_reload_interval'] > 0:
+            asyncio.ensure_future(watch_config_file())
+
+    middleware = aio_log_middleware(timing_sample_rate=options['timing_sample_rate'])
+    app = construct_aio_app(es_client, bulk_indexer=bulk_indexer, log_processor=log_processor,
+                            middlewares=[middleware], **options)
+
+    # Disable default request logging - we're using middleware
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host='0.0.0.0', port=options['port'],
+                       shutdown_timeout=options['shutdown_wait'])
+    await site.start()
+
+    async def warm_up():
+        # Open connections to Elasticsearch before reporting ready, so the first requests don't
+        # have to wait for them to be opened.
+        with startup_timer.time('es_connections'):
+            es_ready = await warm_async_es_connections(es_client, options['es_max_connections'],
+                                                       timeout_s=options['startup_timeout'])
+
+        if not shutting_down.is_set():
+            kong_log_bridge.SERVER_READY = True
+            log_startup(startup_timer, es_ready)
+
+    warm_up_task = asyncio.ensure_future(warm_up())
+
+    with nice_shutdown(shutdown):
+        await shutting_down.wait()
+        kong_log_bridge.SERVER_READY = False
+        warm_up_task.cancel()
+
+        # Sleep for a few seconds to allow for race conditions between sending
+        # the SIGTERM and load balancers stopping sending traffic here.
+        log.info('Shutdown: Sleeping %(sleep_s)s seconds.',
+                 {'sleep_s': options['shutdown_sleep']})
+        await asyncio.sleep(options['shutdown_sleep'])
+
+        log.info('Shutdown: Waiting up to %(wait_s)s seconds for connections to close.',
+                 {'wait_s': options['shutdown_wait']})
+        await runner.cleanup()
+
+        if bulk_indexer:
+            log.info('Shutdown: Indexing buffered logs.')
+            await bulk_indexer.stop()
+
+        await es_client.close()
+
+        log.info('Shutdown: Exiting.')
+
+
 if __name__ == '__main__':
     main(auto_envvar_prefix='KONG_LOG_BRIDGE_OPT')
@@ -0,0 +1,96 @@
+import asyncio
+import io
+
+# Options for constructing a `LogProcessor` (or an app) with no transformations enabled.
+OPTIONS = {
+    'convert_ts': False,
+    'convert_qs_bools': False,
+    'hash_ip': False,
+    'hash_auth': False,
+    'hash_cookie': False,
+    'hash_path': (),
+    'null_path': (),
+    'limit_request_headers': 100,
+    'limit_request_querystring': 100,
+    'expose_ip': (),
+}
+
+
+class FakeEsClient:
+    """
+    Records the documents indexed with it, failing the first `failures` requests. Its transport's
+    connection pool holds `connections`.
+    """
+
+    def __init__(self, failures=0, connections=()):
+        self.failures = failures
+        self.indexed = []
+        self.bulk_bodies = []
+
+        self.transport = type('Transport', (), {})()
+        self.transport.connection_pool = type('ConnectionPool', (), {})()
+        self.transport.connection_pool.connections = list(connections)
+
+    def _maybe_fail(self):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('Some error')
+
+    def index(self, index, id, body, request_timeout):
+        self._maybe_fail()
+        self.indexed.append((id, body))
+
+    def bulk(self, body, index, request_timeout):
+        self._maybe_fail()
+        self.bulk_bodies.append(body)
+        return {'errors': False, 'items': []}
+
+
+class FakeAsyncEsClient:
+    """The async equivalent of `FakeEsClient`, optionally reporting every bulk item as failed."""
+
+    def __init__(self, bulk_errors=False):
+        self.bulk_errors = bulk_errors
+        self.indexed = []
+        self.bulk_bodies = []
+
+    async def index(self, index, id, body, request_timeout):
+        self.indexed.append((id, body))
+
+    async def bulk(self, body, index, request_timeout):
+        self.bulk_bodies.append(body)
+        if self.bulk_errors:
+            return {'errors': True, 'items': [{'index': {'status': 500}}]}
+        return {'errors': False, 'items': []}
+
+
+def call(app, body, content_type='application/json', path='/logs', method='POST'):
+    """Make a request to a WSGI app, returning the response status code and body."""
+
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+    }
+
+    result = {}
+
+    def start_response(status, headers, exc_info=None):
+        result['status'] = int(status.split()[0])
+
+    result['body'] = b''.join(app(environ, start_response))
+    return result['status'], result['body']
+
+
+def run(coro):
+    """Run a coroutine in a new event loop (`asyncio.run()` isn't available in Python 3.6)."""
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
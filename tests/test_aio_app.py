@@ -0,0 +1,119 @@
+import gc
+import json
+import unittest
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from kong_log_bridge.aio import AsyncBulkIndexer, construct_aio_app
+
+from .helpers import OPTIONS, FakeAsyncEsClient, run
+
+
+def post_logs(app, *requests):
+    """Make `(body, content_type)` requests to an app's logs endpoint, returning the responses."""
+
+    async def post_all():
+        async with TestClient(TestServer(app)) as client:
+            responses = []
+            for body, content_type in requests:
+                response = await client.post('/logs', data=body,
+                                             headers={'Content-Type': content_type})
+                responses.append((response.status, await response.read()))
+            return responses
+
+    return run(post_all())
+
+
+class Test(unittest.TestCase):
+
+    def test_logs(self):
+        es_client = FakeAsyncEsClient()
+        app = construct_aio_app(es_client, 'some_index', **OPTIONS)
+
+        responses = post_logs(app,
+                              (b'{"foo": "bar"}', 'application/json'),
+                              (b'{"foo": "bar"}', 'text/plain'),
+                              (b'{"foo": ', 'application/json'),
+                              (b'{"foo": "' + b'x' * 102_400 + b'"}', 'application/json'))
+
+        self.assertEqual((204, b''), responses[0])
+        self.assertEqual([(None, '{"foo": "bar"}')], es_client.indexed)
+        self.assertEqual(415, responses[1][0])
+        self.assertEqual((400, {'error': 'POST data is not valid JSON'}),
+                         (responses[2][0], json.loads(responses[2][1])))
+        self.assertEqual(413, responses[3][0])
+        self.assertEqual(1, len(es_client.indexed))
+
+    def test_logs_bulk(self):
+        es_client = FakeAsyncEsClient()
+        app = construct_aio_app(es_client, 'some_index', **OPTIONS)
+
+        responses = post_logs(app, (b'{"foo": "bar"}\n{"foo": "baz"}\n', 'application/x-ndjson'))
+
+        self.assertEqual([(204, b'')], responses)
+        self.assertEqual([], es_client.indexed)
+        self.assertEqual([b'{"index":{}}\n{"foo": "bar"}\n{"index":{}}\n{"foo": "baz"}\n'],
+                         es_client.bulk_bodies)
+
+        # Failures in the bulk response fail the request.
+        es_client = FakeAsyncEsClient(bulk_errors=True)
+        app = construct_aio_app(es_client, 'some_index', **OPTIONS)
+
+        responses = post_logs(app, (b'{"foo": "bar"}\n{"foo": "baz"}\n', 'application/x-ndjson'))
+
+        self.assertEqual(500, responses[0][0])
+
+    def test_logs_bulk_indexer(self):
+        es_client = FakeAsyncEsClient()
+        bulk_indexer = AsyncBulkIndexer(es_client, 'some_index',
+                                        interval_s=60, flush_bytes=1024, max_buffer_bytes=64)
+        app = construct_aio_app(es_client, 'some_index', bulk_indexer=bulk_indexer, **OPTIONS)
+
+        responses = post_logs(app,
+                              (b'{"foo": "bar"}', 'application/json'),
+                              (b'{"foo": "' + b'x' * 40 + b'"}', 'application/json'))
+
+        self.assertEqual((204, b''), responses[0])
+        self.assertEqual((503, {'error': 'Log buffer is full'}),
+                         (responses[1][0], json.loads(responses[1][1])))
+        self.assertEqual([], es_client.indexed)
+
+        run(bulk_indexer.flush())
+        self.assertEqual([b'{"index":{}}\n{"foo": "bar"}\n'], es_client.bulk_bodies)
+        self.assertEqual(0, bulk_indexer.pending_bytes)
+
+    def test_bulk_indexer_flush_soon(self):
+        es_client = FakeAsyncEsClient()
+        bulk_indexer = AsyncBulkIndexer(es_client, 'some_index',
+                                        interval_s=60, flush_bytes=1, max_buffer_bytes=1024)
+
+        async def add_and_stop():
+            bulk_indexer.start()
+            # Reaching `flush_bytes` starts a flush in the background.
+            self.assertTrue(bulk_indexer.add(b'{"foo":"bar"}'))
+            self.assertEqual(1, len(bulk_indexer._flush_tasks))
+            gc.collect()
+            # Stopping waits for the flush.
+            await bulk_indexer.stop()
+
+        run(add_and_stop())
+        self.assertEqual([b'{"index":{}}\n{"foo":"bar"}\n'], es_client.bulk_bodies)
+        self.assertEqual(0, bulk_indexer.pending_bytes)
+        self.assertEqual(set(), bulk_indexer._flush_tasks)
+
+    def test_max_body_bytes(self):
+        es_client = FakeAsyncEsClient()
+        app = construct_aio_app(es_client, 'some_index', max_body_bytes=16, **OPTIONS)
+
+        responses = post_logs(app,
+                              (b'{"foo": "bar"}', 'application/json'),
+                              (b'{"foo": "barbaz"}', 'application/json'))
+
+        self.assertEqual(204, responses[0][0])
+        self.assertEqual((413, {'error': 'Request entity too large'}),
+                         (responses[1][0], json.loads(responses[1][1])))
+        self.assertEqual(1, len(es_client.indexed))
+
+        app = construct_aio_app(es_client, 'some_index', max_body_bytes=1024 * 1024, **OPTIONS)
+        responses = post_logs(app, (b'{"foo": "' + b'x' * 200_000 + b'"}', 'application/json'))
+        self.assertEqual(204, responses[0][0])
@@ -0,0 +1,50 @@
+import json
+import unittest
+
+from kong_log_bridge import construct_app
+
+from .helpers import OPTIONS, FakeEsClient, call
+
+
+class Test(unittest.TestCase):
+
+    def test_logs(self):
+        es_client = FakeEsClient()
+        app = construct_app(es_client, 'some_index', **OPTIONS)
+
+        self.assertEqual((204, b''), call(app, b'{"foo": "bar"}'))
+        self.assertEqual([(None, '{"foo": "bar"}')], es_client.indexed)
+
+        status, body = call(app, b'{"foo": "bar"}', content_type='text/plain')
+        self.assertEqual(415, status)
+        status, body = call(app, b'{"foo": ')
+        self.assertEqual((400, {'error': 'POST data is not valid JSON'}), (status, json.loads(body)))
+
+    def test_dedup_retry_after_failure(self):
+        es_client = FakeEsClient(failures=1)
+        app = construct_app(es_client, 'some_index',
+                            es_id_path=['request.id'], dedup_window=60, dedup_memory=1,
+                            dedup_fp_rate=0.001, **OPTIONS)
+        body = b'{"request": {"id": "a1b2c3"}}'
+
+        # The first attempt fails to be indexed, so the retry isn't a duplicate.
+        self.assertEqual(500, call(app, body)[0])
+        self.assertEqual(204, call(app, body)[0])
+        self.assertEqual(1, len(es_client.indexed))
+
+        # Once indexed, further retries are dropped.
+        self.assertEqual(204, call(app, body)[0])
+        self.assertEqual(1, len(es_client.indexed))
+
+    def test_max_body_bytes(self):
+        es_client = FakeEsClient()
+        app = construct_app(es_client, 'some_index', max_body_bytes=16, **OPTIONS)
+
+        self.assertEqual(204, call(app, b'{"foo": "bar"}')[0])
+        status, body = call(app, b'{"foo": "barbaz"}')
+        self.assertEqual((413, {'error': 'Request entity too large'}), (status, json.loads(body)))
+        self.assertEqual(1, len(es_client.indexed))
+
+        # Bodies larger than Bottle's default limit can be accepted.
+        app = construct_app(es_client, 'some_index', max_body_bytes=1024 * 1024, **OPTIONS)
+        self.assertEqual(204, call(app, b'{"foo": "' + b'x' * 200_000 + b'"}')[0])
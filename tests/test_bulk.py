@@ -0,0 +1,44 @@
+import json
+import unittest
+
+from kong_log_bridge.bulk import BulkBuffer, BulkIndexer
+
+from .helpers import FakeEsClient
+
+
+class Test(unittest.TestCase):
+
+    def test_bulk_buffer(self):
+        bulk_buffer = BulkBuffer()
+        bulk_buffer.add(b'{"foo":"bar"}')
+        bulk_buffer.add(b'{"foo":"baz"}', doc_id='some_id')
+
+        self.assertEqual(2, bulk_buffer.count)
+        self.assertEqual(69, len(bulk_buffer))
+
+        body, count = bulk_buffer.take()
+        self.assertEqual(2, count)
+        self.assertEqual([{'index': {}}, {'foo': 'bar'},
+                          {'index': {'_id': 'some_id'}}, {'foo': 'baz'}],
+                         [json.loads(line) for line in body.splitlines()])
+        self.assertTrue(body.endswith(b'\n'))
+
+        self.assertEqual(0, bulk_buffer.count)
+        self.assertEqual(0, len(bulk_buffer))
+
+    def test_bulk_indexer(self):
+        es_client = FakeEsClient()
+        bulk_indexer = BulkIndexer(es_client, 'some_index',
+                                   interval_s=60, flush_bytes=1024, max_buffer_bytes=64)
+
+        self.assertTrue(bulk_indexer.add(b'{"foo":"bar"}'))
+        self.assertEqual(27, bulk_indexer.pending_bytes)
+        self.assertFalse(bulk_indexer.add(b'{"foo":"' + b'x' * 40 + b'"}'))
+
+        bulk_indexer.flush()
+        self.assertEqual([b'{"index":{}}\n{"foo":"bar"}\n'], es_client.bulk_bodies)
+        self.assertEqual(0, bulk_indexer.pending_bytes)
+
+        # Nothing to flush
+        bulk_indexer.flush()
+        self.assertEqual(1, len(es_client.bulk_bodies))
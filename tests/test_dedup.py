@@ -0,0 +1,95 @@
+import unittest
+
+from kong_log_bridge.dedup import BloomFilter, Deduplicator, document_id
+from kong_log_bridge.transform import Hasher
+
+
+class Test(unittest.TestCase):
+
+    def test_document_id(self):
+        test_log = {
+            'request': {
+                'headers': {
+                    'x-kong-request-id': 'a1b2c3',
+                },
+            },
+            'started_at': 1595326603250,
+        }
+
+        doc_id = document_id(test_log, ['request.headers.x-kong-request-id'])
+        self.assertIsNotNone(doc_id)
+        self.assertEqual(doc_id, document_id(dict(test_log), ['request.headers.x-kong-request-id']))
+
+        other_log = {
+            'request': {
+                'headers': {
+                    'x-kong-request-id': 'd4e5f6',
+                },
+            },
+            'started_at': 1595326603250,
+        }
+        self.assertNotEqual(doc_id, document_id(other_log, ['request.headers.x-kong-request-id']))
+
+        self.assertIsNone(document_id(test_log, ['request.headers.x-missing']))
+
+    def test_document_id_multiple_paths(self):
+        test_log = {'client_ip': '1.2.3.4', 'started_at': 1595326603250}
+
+        self.assertNotEqual(document_id(test_log, ['client_ip', 'started_at']),
+                            document_id(test_log, ['client_ip']))
+
+    def test_document_id_keyed(self):
+        test_log = {'client_ip': '1.2.3.4'}
+
+        doc_id = document_id(test_log, ['client_ip'], Hasher(key=b'secret'))
+        self.assertEqual(doc_id, document_id(test_log, ['client_ip'], Hasher(key=b'secret')))
+        self.assertNotEqual(doc_id, document_id(test_log, ['client_ip']))
+
+    def test_bloom_filter(self):
+        bloom_filter = BloomFilter(1024, 0.01)
+
+        for i in range(100):
+            bloom_filter.add(f'item-{i}')
+
+        for i in range(100):
+            self.assertIn(f'item-{i}', bloom_filter)
+
+        false_positives = sum(f'other-{i}' in bloom_filter for i in range(1000))
+        self.assertLess(false_positives, 50)
+
+    def test_deduplicator(self):
+        now = 0
+
+        def clock():
+            return now
+
+        deduplicator = Deduplicator(window_s=10, size_bytes=1024, fp_rate=0.001, clock=clock)
+
+        self.assertFalse(deduplicator.contains('a'))
+        # Not seen until added.
+        self.assertFalse(deduplicator.contains('a'))
+        deduplicator.add('a')
+        self.assertTrue(deduplicator.contains('a'))
+
+        now = 15
+        self.assertTrue(deduplicator.contains('a'))
+        self.assertFalse(deduplicator.contains('b'))
+        deduplicator.add('b')
+
+        now = 30
+        self.assertFalse(deduplicator.contains('a'))
+        self.assertTrue(deduplicator.contains('b'))
+
+    def test_deduplicator_fp_rate(self):
+        deduplicator = Deduplicator(window_s=60, size_bytes=16 * 1024, fp_rate=0.01,
+                                    clock=lambda: 0)
+
+        # Fill both generations to (just under) capacity, rotating once.
+        capacity = deduplicator._current.capacity
+        i = 0
+        while deduplicator._previous.count < capacity or deduplicator._current.count < capacity - 1:
+            deduplicator.add(f'seen-{i}')
+            i += 1
+
+        false_positives = sum(deduplicator.contains(f'other-{i}') for i in range(20_000))
+        self.assertLess(false_positives / 20_000, 0.012)
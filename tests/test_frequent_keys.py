@@ -0,0 +1,22 @@
+import unittest
+
+from kong_log_bridge.frequent_keys import FrequentKeys
+
+
+class Test(unittest.TestCase):
+
+    def test_frequent_keys(self):
+        frequent_keys = FrequentKeys(2, capacity=4, refresh_interval=8)
+
+        for i in range(100):
+            frequent_keys.observe(['host', 'accept', f'x-random-{i}'])
+            if i % 2:
+                frequent_keys.observe(['user-agent'])
+
+        self.assertEqual(frozenset(['host', 'accept']), frequent_keys.top_keys)
+
+    def test_frequent_keys_warm_up(self):
+        frequent_keys = FrequentKeys(2, refresh_interval=1000)
+
+        frequent_keys.observe(['host'])
+        self.assertEqual(frozenset(['host']), frequent_keys.top_keys)
@@ -0,0 +1,126 @@
+import logging
+import unittest
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from kong_log_bridge import construct_app
+from kong_log_bridge.aio import construct_aio_app
+from utils.aio_logging import aio_log_middleware
+from utils.logging import (NULL_STAGE_TIMER, STAGE_TIMER_ENVIRON_KEY, NullStageTimer, StageTimer,
+                           get_stage_timer, wsgi_log_middleware)
+
+from .helpers import OPTIONS, FakeAsyncEsClient, FakeEsClient, call, run
+
+STAGES = ['read_body', 'decode', 'transform', 'serialize', 'es_index']
+
+
+def logged_vals(logs):
+    # The request log's values, from the args of its (only) record.
+    [record] = logs.records
+    return record.args
+
+
+class Test(unittest.TestCase):
+
+    def test_stage_timer(self):
+        stage_timer = StageTimer()
+        with stage_timer.time('foo'):
+            pass
+        with self.assertRaises(ValueError):
+            with stage_timer.time('bar'):
+                raise ValueError()
+
+        # Stages are recorded even if they raise.
+        self.assertEqual(['foo', 'bar'], list(stage_timer.timings))
+        self.assertTrue(all(isinstance(t, int) and t >= 0 for t in stage_timer.timings.values()))
+
+    def test_null_stage_timer(self):
+        null_stage_timer = NullStageTimer()
+        with null_stage_timer.time('foo'):
+            pass
+        self.assertIsNone(null_stage_timer.timings)
+
+        self.assertIs(NULL_STAGE_TIMER, get_stage_timer({}))
+        stage_timer = StageTimer()
+        self.assertIs(stage_timer, get_stage_timer({STAGE_TIMER_ENVIRON_KEY: stage_timer}))
+
+    def test_wsgi_log_middleware(self):
+        request_logger = logging.getLogger('test_wsgi_request')
+
+        app = construct_app(FakeEsClient(), 'some_index', **OPTIONS)
+        timed_app = wsgi_log_middleware(app, request_logger=request_logger, timing_sample_rate=1)
+        with self.assertLogs(request_logger) as logs:
+            self.assertEqual(204, call(timed_app, b'{"foo": "bar"}')[0])
+
+        log_vals = logged_vals(logs)
+        self.assertEqual(204, log_vals['status_code'])
+        self.assertIsInstance(log_vals['elapsed_time_us'], int)
+        self.assertEqual(STAGES, list(log_vals['stage_times_us']))
+
+        # Unsampled requests have no timer installed, and don't log timings.
+        environs = []
+
+        def recording_app(environ, start_response):
+            environs.append(environ)
+            return app(environ, start_response)
+
+        untimed_app = wsgi_log_middleware(recording_app, request_logger=request_logger,
+                                          timing_sample_rate=0)
+        with self.assertLogs(request_logger) as logs:
+            self.assertEqual(204, call(untimed_app, b'{"foo": "bar"}')[0])
+
+        self.assertIs(NULL_STAGE_TIMER, get_stage_timer(environs[0]))
+        log_vals = logged_vals(logs)
+        self.assertEqual(204, log_vals['status_code'])
+        self.assertNotIn('elapsed_time_us', log_vals)
+        self.assertNotIn('stage_times_us', log_vals)
+
+    def test_aio_log_middleware(self):
+        request_logger = logging.getLogger('test_aio_request')
+
+        def post_log(timing_sample_rate):
+            app = construct_aio_app(FakeAsyncEsClient(), 'some_index', middlewares=[
+                aio_log_middleware(request_logger=request_logger,
+                                   timing_sample_rate=timing_sample_rate),
+            ], **OPTIONS)
+
+            async def post():
+                async with TestClient(TestServer(app)) as client:
+                    response = await client.post('/logs', data=b'{"foo": "bar"}',
+                                                 headers={'Content-Type': 'application/json'})
+                    return response.status
+
+            with self.assertLogs(request_logger) as logs:
+                self.assertEqual(204, run(post()))
+            return logged_vals(logs)
+
+        log_vals = post_log(timing_sample_rate=1)
+        self.assertEqual(204, log_vals['status_code'])
+        self.assertIsInstance(log_vals['elapsed_time_us'], int)
+        self.assertEqual(STAGES, list(log_vals['stage_times_us']))
+
+        log_vals = post_log(timing_sample_rate=0)
+        self.assertEqual(204, log_vals['status_code'])
+        self.assertNotIn('elapsed_time_us', log_vals)
+        self.assertNotIn('stage_times_us', log_vals)
+
+    def test_aio_log_middleware_unsampled_timer(self):
+        request_logger = logging.getLogger('test_aio_request')
+        stage_timers = []
+
+        async def handler(request):
+            stage_timers.append(get_stage_timer(request))
+            return web.Response(status=204)
+
+        app = web.Application(middlewares=[aio_log_middleware(request_logger=request_logger,
+                                                              timing_sample_rate=0)])
+        app.router.add_get('/', handler)
+
+        async def get():
+            async with TestClient(TestServer(app)) as client:
+                return (await client.get('/')).status
+
+        with self.assertLogs(request_logger):
+            self.assertEqual(204, run(get()))
+        self.assertEqual([NULL_STAGE_TIMER], stage_timers)
@@ -0,0 +1,21 @@
+import unittest
+
+from utils.lru import LRUCache
+
+
+class Test(unittest.TestCase):
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+
+        # 'b' is now the least recently used entry, so is evicted.
+        cache.put('c', 3)
+        self.assertEqual(2, len(cache))
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
@@ -0,0 +1,107 @@
+import json
+import os
+import tempfile
+import unittest
+
+from kong_log_bridge.processor import LogProcessor, ReloadableLogProcessor, load_config_file
+
+from .helpers import OPTIONS
+
+QUOTA_OPTIONS = {
+    **OPTIONS,
+    'quota_key_path': ('service.name',),
+    'quota_rate': 1.0,
+    'quota_burst': 0.0,
+    'quota_max_keys': 100,
+    'quota_sample_rate': 0.0,
+}
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.config_file = os.path.join(self.directory.name, 'config.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_config(self, config):
+        with open(self.config_file, 'w') as f:
+            f.write(config if isinstance(config, str) else json.dumps(config))
+
+    def test_process_verbatim(self):
+        # With no transformations, logs are passed through verbatim, even with cacheable objects.
+        log_processor = LogProcessor(**{**OPTIONS, 'sub_object_cache_size': 1024})
+        body = ('{"service": {"id": "adc094b9", "updated_at": 1595260351, "name": "foo"},\n'
+                ' "route": {"id": "b01758b0", "updated_at": 1595260351},\n'
+                ' "started_at": 1595326603250}')
+
+        for _ in range(2):
+            self.assertEqual([(None, body.replace('\n', ' '))],
+                             log_processor.process(body.encode('utf-8')))
+
+    def test_process_duplicate_keys(self):
+        log_processor = LogProcessor(**OPTIONS)
+
+        self.assertEqual([(None, '{"foo":{"bar":2},"baz":3}')],
+                         log_processor.process(b'{"foo": {"bar": 1, "bar": 2}, "baz": 3}'))
+
+    def test_quota_burst_default(self):
+        # The burst defaults to the rate, but at least 1, so rates under 1 still let logs through.
+        self.assertEqual(1, LogProcessor(**{**QUOTA_OPTIONS, 'quota_rate': 0.5}).quotas.burst)
+        self.assertEqual(5, LogProcessor(**{**QUOTA_OPTIONS, 'quota_rate': 5}).quotas.burst)
+
+        log_processor = LogProcessor(**{**QUOTA_OPTIONS, 'quota_rate': 0.5})
+        self.assertEqual(1, len(log_processor.process(b'{"service": {"name": "foo"}}')))
+
+    def test_load_config_file(self):
+        self.write_config({'hash-path': ['request.headers.x-user'],
+                           'limit_request_headers': 10,
+                           'hash-ip': True,
+                           'limit-keys-by': 'frequency'})
+
+        self.assertEqual({'hash_path': ['request.headers.x-user'],
+                          'limit_request_headers': 10,
+                          'hash_ip': True,
+                          'limit_keys_by': 'frequency'},
+                         load_config_file(self.config_file))
+
+    def test_load_config_file_invalid(self):
+        for config in ['[]', '{"hash-path": "request"}', '{"hash-path": [1]}',
+                       '{"limit-request-headers": true}', '{"hash-ip": 1}',
+                       '{"limit-keys-by": "size"}', '{"es-node": ["localhost"]}', '{']:
+            with self.subTest(config=config):
+                self.write_config(config)
+                with self.assertRaises(ValueError):
+                    load_config_file(self.config_file)
+
+    def test_reloadable_log_processor(self):
+        body = b'{"service": {"name": "foo"}, "request": {"headers": {"x-user": "bar"}}}'
+
+        self.write_config({})
+        log_processor = ReloadableLogProcessor(self.config_file, QUOTA_OPTIONS)
+        quotas = log_processor.quotas
+
+        [(_, doc)] = log_processor.process(body)
+        self.assertEqual('bar', json.loads(doc)['request']['headers']['x-user'])
+        self.assertFalse(log_processor.reload_if_changed())
+
+        self.write_config({'null-path': ['request.headers.x-user']})
+        # Make sure the file looks changed, even if the filesystem's timestamps are coarse.
+        os.utime(self.config_file, ns=(0, 0))
+        self.assertTrue(log_processor.reload_if_changed())
+
+        # Quotas are kept, so the quota of 1 log per second has already been used.
+        self.assertIs(quotas, log_processor.quotas)
+        self.assertEqual([], log_processor.process(body))
+
+        body = b'{"service": {"name": "baz"}, "request": {"headers": {"x-user": "bar"}}}'
+        [(_, doc)] = log_processor.process(body)
+        self.assertIsNone(json.loads(doc)['request']['headers']['x-user'])
+
+        # Invalid config files are ignored, keeping the current config.
+        processor = log_processor.processor
+        self.write_config({'null-path': 'request.headers.x-user'})
+        self.assertFalse(log_processor.reload())
+        self.assertIs(processor, log_processor.processor)
@@ -0,0 +1,94 @@
+import json
+import unittest
+
+from kong_log_bridge.quota import OTHER_KEY, Quotas
+
+
+class Test(unittest.TestCase):
+
+    def test_quotas(self):
+        now = 0
+
+        def clock():
+            return now
+
+        quotas = Quotas(['service.name'], rate=1, burst=2, max_keys=10, clock=clock)
+        noisy_log = {'service': {'name': 'noisy'}}
+        quiet_log = {'service': {'name': 'quiet'}}
+
+        self.assertEqual([True, True, False, False],
+                         [quotas.allow(noisy_log) for _ in range(4)])
+        self.assertTrue(quotas.allow(quiet_log))
+        self.assertTrue(quotas.allow({'service': {}}))
+
+        # Bucket refills over time.
+        now = 1.5
+        self.assertEqual([True, False], [quotas.allow(noisy_log) for _ in range(2)])
+
+        summaries = [json.loads(doc) for doc in quotas.take_summary_documents()]
+        self.assertEqual(1, len(summaries))
+        self.assertEqual({'key_path': 'service.name', 'key': 'noisy', 'dropped': 3, 'sampled': 0},
+                         {k: v for k, v in summaries[0]['quota_summary'].items() if k != 'period_s'})
+        self.assertIsInstance(summaries[0]['started_at'], int)
+
+        self.assertEqual([], quotas.take_summary_documents())
+
+    def test_quotas_multiple_paths(self):
+        quotas = Quotas(['service.name', 'consumer.id'], rate=1, burst=2, max_keys=10,
+                        clock=lambda: 0)
+        noisy_log = {'service': {'name': 'noisy'}, 'consumer': {'id': 'a'}}
+        quiet_log = {'service': {'name': 'quiet'}, 'consumer': {'id': 'a'}}
+
+        self.assertTrue(quotas.allow({'service': {'name': 'noisy'}}))
+        self.assertTrue(quotas.allow({'service': {'name': 'noisy'}}))
+
+        # Logs dropped by the noisy service's quota don't use up the consumer's quota.
+        self.assertEqual([False] * 5, [quotas.allow(noisy_log) for _ in range(5)])
+        self.assertEqual([True, True, False], [quotas.allow(quiet_log) for _ in range(3)])
+
+        keys = sorted((summary['key_path'], summary['key'], summary['dropped'])
+                      for summary in (json.loads(doc)['quota_summary']
+                                      for doc in quotas.take_summary_documents()))
+        self.assertEqual([('consumer.id', 'a', 1), ('service.name', 'noisy', 5),
+                          ('service.name', 'quiet', 1)], keys)
+
+    def test_quotas_rate_under_one(self):
+        now = 0
+
+        def clock():
+            return now
+
+        # One log every 2 seconds.
+        quotas = Quotas(['service.name'], rate=0.5, burst=1, max_keys=10, clock=clock)
+        test_log = {'service': {'name': 'a'}}
+
+        self.assertEqual([True, False], [quotas.allow(test_log) for _ in range(2)])
+        now = 1
+        self.assertFalse(quotas.allow(test_log))
+        now = 2
+        self.assertEqual([True, False], [quotas.allow(test_log) for _ in range(2)])
+
+        with self.assertRaises(ValueError):
+            Quotas(['service.name'], rate=0.5, burst=0.5, max_keys=10)
+
+    def test_quotas_sampled(self):
+        quotas = Quotas(['route.id'], rate=1, burst=1, max_keys=10, sample_rate=1.0,
+                        clock=lambda: 0)
+        test_log = {'route': {'id': 'a'}}
+
+        self.assertEqual([True, True], [quotas.allow(test_log) for _ in range(2)])
+
+        summary = json.loads(quotas.take_summary_documents(convert_ts=True)[0])
+        self.assertEqual(1, summary['quota_summary']['sampled'])
+        self.assertIsInstance(summary['started_at'], str)
+
+    def test_quotas_max_keys(self):
+        quotas = Quotas(['consumer.id'], rate=1, burst=1, max_keys=2, clock=lambda: 0)
+
+        for consumer_id in ['a', 'b', 'c']:
+            for _ in range(2):
+                quotas.allow({'consumer': {'id': consumer_id}})
+
+        keys = sorted(json.loads(doc)['quota_summary']['key']
+                      for doc in quotas.take_summary_documents())
+        self.assertEqual([OTHER_KEY, 'a', 'b'], keys)
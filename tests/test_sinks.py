@@ -0,0 +1,107 @@
+import gevent
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from kong_log_bridge.sinks import ElasticsearchSink, FileSink
+
+from .helpers import FakeEsClient
+
+
+def wait_until_sent(sink):
+    while sink.pending_bytes:
+        gevent.sleep(0.001)
+
+
+class Test(unittest.TestCase):
+
+    def test_elasticsearch_sink(self):
+        es_client = FakeEsClient()
+        sink = ElasticsearchSink(es_client, 'some_index', name='test',
+                                 interval_s=60, batch_bytes=20, max_queue_bytes=64, workers=2)
+        sink.start()
+
+        self.assertTrue(sink.add_many([(None, b'{"foo":"bar"}')]))
+        self.assertTrue(sink.add_many([('some_id', b'{"foo":"baz"}')]))
+        self.assertEqual(26, sink.pending_bytes)
+
+        # Too big to fit in the queue with the pending documents.
+        self.assertFalse(sink.add_many([(None, b'{"foo":"' + b'x' * 40 + b'"}')]))
+        self.assertEqual(1, sink.dropped)
+
+        self.assertTrue(sink.add_many([(None, b'{"foo":"qux"}')]))
+
+        sink.stop()
+        self.assertEqual([b'{"index":{}}\n{"foo":"bar"}\n'
+                          b'{"index":{"_id":"some_id"}}\n{"foo":"baz"}\n',
+                          b'{"index":{}}\n{"foo":"qux"}\n'],
+                         es_client.bulk_bodies)
+        self.assertEqual(0, sink.pending_bytes)
+
+    def test_sink_retries(self):
+        es_client = FakeEsClient(failures=2)
+        sink = ElasticsearchSink(es_client, 'some_index', name='test',
+                                 interval_s=60, batch_bytes=1, max_queue_bytes=1024,
+                                 retries=2, retry_backoff_s=0.001)
+        sink.start()
+        sink.add_many([(None, b'{"foo":"bar"}')])
+        wait_until_sent(sink)
+        sink.stop()
+
+        self.assertEqual([b'{"index":{}}\n{"foo":"bar"}\n'], es_client.bulk_bodies)
+
+        # Dropped once retries are used up.
+        es_client = FakeEsClient(failures=2)
+        sink = ElasticsearchSink(es_client, 'some_index', name='test',
+                                 interval_s=60, batch_bytes=1, max_queue_bytes=1024,
+                                 retries=1, retry_backoff_s=0.001)
+        sink.start()
+        sink.add_many([(None, b'{"foo":"bar"}')])
+        wait_until_sent(sink)
+        sink.stop()
+
+        self.assertEqual([], es_client.bulk_bodies)
+        self.assertEqual(0, sink.pending_bytes)
+
+    def test_file_sink(self):
+        now = [1597556426.0]
+
+        with tempfile.TemporaryDirectory() as directory:
+            sink = FileSink(directory, max_file_bytes=1024 * 1024, max_file_age_s=60,
+                            clock=lambda: now[0], name='test',
+                            interval_s=60, batch_bytes=1, max_queue_bytes=1024)
+            sink.start()
+
+            sink.add_many([(None, b'{"foo":"bar"}'), ('some_id', b'{"foo":"baz"}')])
+            wait_until_sent(sink)
+            # Rotated by age on the next write.
+            now[0] += 60
+            sink.add_many([(None, b'{"foo":"qux"}')])
+
+            sink.stop()
+
+            self.assertEqual(['kong-requests-20200816T054026Z-000001.jsonl.gz',
+                              'kong-requests-20200816T054126Z-000002.jsonl.gz'],
+                             sorted(os.listdir(directory)))
+
+            contents = []
+            for name in sorted(os.listdir(directory)):
+                with gzip.open(os.path.join(directory, name)) as f:
+                    contents.append([json.loads(line) for line in f])
+
+            self.assertEqual([[{'foo': 'bar'}, {'foo': 'baz'}], [{'foo': 'qux'}]], contents)
+
+    def test_file_sink_rotate_by_size(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sink = FileSink(directory, max_file_bytes=1, max_file_age_s=60, name='test',
+                            interval_s=60, batch_bytes=1, max_queue_bytes=1024)
+            sink.start()
+            for i in range(3):
+                sink.add_many([(None, json.dumps({'foo': i}).encode('utf-8'))])
+            sink.stop()
+
+            names = sorted(os.listdir(directory))
+            self.assertEqual(3, len(names))
+            self.assertFalse(any(name.endswith('.part') for name in names))
@@ -0,0 +1,93 @@
+import json
+import unittest
+
+from kong_log_bridge.splice import DuplicateKeyError, decode_logs, decode_object, encode_object
+from kong_log_bridge.transform import transform_log
+
+
+class Test(unittest.TestCase):
+
+    def test_decode_object(self):
+        text = '{"foo": "bar",\n "baz": {"a": [1, 2.10]}}'
+
+        obj, spans = decode_object(text)
+        self.assertEqual({'foo': 'bar', 'baz': {'a': [1, 2.1]}}, obj)
+        self.assertEqual('"foo": "bar"', text[slice(*spans['foo'])])
+        self.assertEqual('"baz": {"a": [1, 2.10]}', text[slice(*spans['baz'])])
+
+        self.assertEqual(({}, {}), decode_object(' {} '))
+        self.assertEqual(([1], None), decode_object('[1]'))
+
+    def test_decode_object_invalid(self):
+        for text in ['', '{', '{"foo"}', '{"foo": }', '{"foo": 1 "bar": 2}', '{foo: 1}',
+                     '{"foo": 1}}', '{"foo": 1,}']:
+            with self.subTest(text=text):
+                with self.assertRaises(json.JSONDecodeError):
+                    decode_object(text)
+
+    def test_decode_object_duplicate_keys(self):
+        for text in ['{"foo": 1, "foo": 2}', '{"foo": {"bar": 1, "bar": 2}}', '[{"a": 1, "a": 1}]']:
+            with self.subTest(text=text):
+                with self.assertRaises(DuplicateKeyError):
+                    decode_object(text)
+
+    def test_encode_object_unchanged(self):
+        text = '{\n  "foo": "bar",\n  "baz": 2.10\n}\n'
+        obj, spans = decode_object(text)
+
+        self.assertEqual('{   "foo": "bar",   "baz": 2.10 }', encode_object(obj, obj, text, spans))
+
+    def test_encode_object_transformed(self):
+        text = ('{"client_ip": "1.2.3.4",\n'
+                ' "request": {"headers": {"authorization": "Bearer some_token"}},\n'
+                ' "latencies": {"request": 191.0}}')
+        obj, spans = decode_object(text)
+
+        result = transform_log(obj, do_hash_ip=True, expose_ips=['Pk7QhG5N_LBhKQyqtwiOSQ'])
+        encoded = encode_object(result, obj, text, spans)
+
+        self.assertEqual('{"client_ip":"Pk7QhG5N_LBhKQyqtwiOSQ",'
+                         '"request": {"headers": {"authorization": "Bearer some_token"}},'
+                         '"latencies": {"request": 191.0},'
+                         '"raw_client_ip":"1.2.3.4"}',
+                         encoded)
+        self.assertEqual(result, json.loads(encoded))
+
+    def test_decode_logs(self):
+        text = '{"foo": 1}'
+        self.assertEqual([({'foo': 1}, '{"foo": 1}', {'foo': (1, 9)})], decode_logs(text))
+
+        text = ' [{"foo": 1}, 2,\n{ "bar": [3]} ] '
+        self.assertEqual([({'foo': 1}, '{"foo": 1}', {'foo': (1, 9)}),
+                          (2, '2', None),
+                          ({'bar': [3]}, '{ "bar": [3]}', {'bar': (2, 12)})],
+                         decode_logs(text))
+
+        self.assertEqual([], decode_logs('[ ]'))
+
+    def test_decode_logs_ndjson(self):
+        text = '{"foo": 1}\n\n [2]\r\n{"bar": 3}\n'
+        self.assertEqual([({'foo': 1}, '{"foo": 1}', {'foo': (1, 9)}),
+                          ([2], '[2]', None),
+                          ({'bar': 3}, '{"bar": 3}', {'bar': (1, 9)})],
+                         decode_logs(text, ndjson=True))
+
+        # Arrays aren't batches in NDJSON, and values can't span lines.
+        self.assertEqual([([{'foo': 1}], '[{"foo": 1}]', None)],
+                         decode_logs('[{"foo": 1}]', ndjson=True))
+        with self.assertRaises(json.JSONDecodeError):
+            decode_logs('{"foo":\n1}', ndjson=True)
+
+    def test_decode_logs_invalid(self):
+        for text in ['', '[', '[1,]', '[1 2]', '[1]]', '{"foo": 1} {"bar": 2}']:
+            with self.subTest(text=text):
+                with self.assertRaises(json.JSONDecodeError):
+                    decode_logs(text)
+
+    def test_decode_logs_duplicate_keys(self):
+        # Objects with duplicate keys are collapsed and re-encoded, as Elasticsearch rejects them.
+        text = '[{"foo": 1, "bar": 2, "foo": 3}, {"baz": {"a": 1, "a": [2]}}]'
+        self.assertEqual([({'foo': 3, 'bar': 2}, '{"foo":3,"bar":2}',
+                           {'foo': (1, 8), 'bar': (9, 16)}),
+                          ({'baz': {'a': [2]}}, '{"baz":{"a":[2]}}', {'baz': (1, 16)})],
+                         decode_logs(text))
@@ -1,6 +1,10 @@
+import random
 import unittest
 
-from kong_log_bridge.transform import transform_log
+from kong_log_bridge.frequent_keys import FrequentKeys
+from kong_log_bridge.transform import (Hasher, compile_value_limits, hash_value, transform_log,
+                                       transform_logs)
+from utils.lru import LRUCache
 
 
 class Test(unittest.TestCase):
@@ -335,3 +339,243 @@ class Test(unittest.TestCase):
         result = transform_log(test_log,
                                null_paths=['foo[].bar'])
         self.assertEqual(expected, result)
+
+    def test_sub_object_cache(self):
+        test_log = {
+            'service': {
+                'id': 'adc094b9-1359-5576-8973-5f5aac508101',
+                'name': 'example.default.80',
+                'created_at': 1595260351,
+                'updated_at': 1595260351,
+            },
+            'route': {
+                'id': 'b01758b0-be33-5274-adfd-e53704dc2e4c',
+                'created_at': 1595260351,
+                'updated_at': 1595260351,
+                'paths': ['/'],
+            },
+            'started_at': 1595326603250,
+        }
+        expected = {
+            'service': {
+                'id': 'adc094b9-1359-5576-8973-5f5aac508101',
+                'name': 'aRS71EVu7oVMANbeIa61Gw',
+                'created_at': '2020-07-20T15:52:31+00:00',
+                'updated_at': '2020-07-20T15:52:31+00:00',
+            },
+            'route': {
+                'id': 'b01758b0-be33-5274-adfd-e53704dc2e4c',
+                'created_at': '2020-07-20T15:52:31+00:00',
+                'updated_at': '2020-07-20T15:52:31+00:00',
+                'paths': None,
+            },
+            'started_at': '2020-07-21T10:16:43+00:00',
+        }
+
+        cache = LRUCache(10)
+        options = {
+            'do_convert_ts': True,
+            'hash_paths': ['service.name'],
+            'null_paths': ['route.paths'],
+        }
+
+        self.assertEqual(expected, transform_log(test_log, **options))
+
+        result = transform_log(test_log, sub_object_cache=cache, **options)
+        self.assertEqual(expected, result)
+        self.assertEqual(2, len(cache))
+
+        # Cached objects are reused for subsequent logs.
+        result = transform_log(test_log, sub_object_cache=cache, **options)
+        self.assertEqual(expected, result)
+        self.assertIs(cache.get(('service', 'adc094b9-1359-5576-8973-5f5aac508101', 1595260351)),
+                      result['service'])
+
+    def test_sub_object_cache_untransformed(self):
+        test_log = {
+            'service': {
+                'id': 'adc094b9-1359-5576-8973-5f5aac508101',
+                'name': 'example.default.80',
+                'updated_at': 1595260351,
+            },
+            'route': {
+                'id': 'b01758b0-be33-5274-adfd-e53704dc2e4c',
+                'updated_at': 1595260351,
+            },
+        }
+        cache = LRUCache(10)
+
+        # Objects with nothing to transform aren't cached, and the log isn't copied.
+        self.assertIs(test_log, transform_log(test_log, sub_object_cache=cache))
+        self.assertEqual(0, len(cache))
+
+        # Objects the transformation doesn't change keep their own value.
+        options = {'null_paths': ['service.missing']}
+        for _ in range(2):
+            log = {k: dict(v) for k, v in test_log.items()}
+            self.assertIs(log, transform_log(log, sub_object_cache=cache, **options))
+        self.assertEqual(1, len(cache))
+
+    def test_no_convert_ts(self):
+        test_log = {'started_at': 1595326603250}
+
+        result = transform_log(test_log)
+        self.assertEqual(test_log, result)
+
+    def test_limit_request_headers(self):
+        test_log = {
+            'request': {
+                'headers': {'a': '1', 'b': '2', 'c': '3'},
+            },
+        }
+        expected = {
+            'request': {
+                'headers': {'a': '1', 'b': '2'},
+            },
+        }
+
+        result = transform_log(test_log, limit_request_headers=2)
+        self.assertEqual(expected, result)
+
+        result = transform_log(test_log, limit_request_headers=3)
+        self.assertIs(test_log, result)
+
+    def test_limit_request_headers_frequent(self):
+        request_headers_keys = FrequentKeys(2)
+
+        for _ in range(3):
+            transform_log({'request': {'headers': {'b': '2', 'c': '3'}}},
+                          request_headers_keys=request_headers_keys)
+
+        test_log = {
+            'request': {
+                'headers': {'a': '1', 'b': '2', 'c': '3'},
+            },
+        }
+        expected = {
+            'request': {
+                'headers': {'b': '2', 'c': '3', '_overflow': '{"a":"1"}'},
+            },
+        }
+
+        result = transform_log(test_log,
+                               limit_request_headers=2,
+                               request_headers_keys=request_headers_keys)
+        self.assertEqual(expected, result)
+
+    def test_keyed_hasher(self):
+        test_log = {'client_ip': '1.2.3.4'}
+
+        # An empty key is equivalent to no key.
+        self.assertEqual(transform_log(test_log, do_hash_ip=True),
+                         transform_log(test_log, do_hash_ip=True, hasher=Hasher(key=b'')))
+
+        hasher = Hasher(key=b'some_key')
+        result = transform_log(test_log, do_hash_ip=True, hasher=hasher)
+        self.assertNotEqual('Pk7QhG5N_LBhKQyqtwiOSQ', result['client_ip'])
+        self.assertEqual(hasher('1.2.3.4'), result['client_ip'])
+
+        result = transform_log(test_log, do_hash_ip=True, hasher=hasher,
+                               expose_ips=frozenset([hasher('1.2.3.4')]))
+        self.assertEqual('1.2.3.4', result['raw_client_ip'])
+
+    def test_hash_many(self):
+        hasher = Hasher(key=b'some_key')
+        values = ['a', 1, None, 'a', ['a']]
+
+        self.assertEqual([hasher(value) for value in values], hasher.hash_many(values))
+
+    def test_truncate_values(self):
+        test_log = {
+            'request': {
+                'headers': {
+                    'referer': 'https://example.com/login?continue=https%3A%2F%2Fexample.com',
+                    'user-agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:79.0)',
+                    'accept': ['text/html', 'application/xhtml+xml,application/xml;q=0.9'],
+                },
+                'uri': '/login',
+            },
+            'upstream_uri': '/ünïcode',
+        }
+        expected = {
+            'request': {
+                'headers': {
+                    'referer': 'https://example.com/login?continue=https%3A%2F%2Fexample.com',
+                    'user-agent': 'Mozilla/5.0 (X11; Ubuntu; L',
+                    'accept': ['text/html', 'application/xhtml+xml,app'],
+                },
+                'uri': '/login',
+            },
+            'upstream_uri': '/ün',
+            'truncated_values': 3,
+        }
+
+        value_limits = compile_value_limits(25, {'request.headers.referer': 0,
+                                                 'request.headers.user-agent': 27,
+                                                 'upstream_uri': 4})
+        result = transform_log(test_log, value_limits=value_limits)
+        self.assertEqual(expected, result)
+
+        # Untruncated values are left as is.
+        self.assertIs(test_log['request']['headers']['referer'],
+                      result['request']['headers']['referer'])
+        self.assertIs(test_log, transform_log(test_log, value_limits=compile_value_limits(1000)))
+
+    def test_truncate_values_hashed(self):
+        value = 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:79.0) Gecko/20100101 Firefox/79.0'
+        test_log = {'request': {'headers': {'user-agent': value}}}
+
+        result = transform_log(test_log,
+                               value_limits=compile_value_limits(40),
+                               hash_truncated_values=True)
+
+        truncated = result['request']['headers']['user-agent']
+        self.assertEqual(40, len(truncated))
+        self.assertEqual(f'Mozilla/5.0 (X1...{hash_value(value)}', truncated)
+
+    def test_transform_logs(self):
+        # Check batches give the same results as transforming each log, for random batches of logs
+        # with repeated values.
+        rng = random.Random(1234)
+
+        def random_log():
+            return {
+                'client_ip': rng.choice(['1.2.3.4', '5.6.7.8', '9.10.11.12']),
+                'started_at': rng.choice([1597556426000, 1597556427123]),
+                'request': {
+                    'headers': {
+                        'authorization': rng.choice(['Bearer a', 'Bearer b']),
+                        'cookie': rng.choice(['a=1; b=2', 'a=1', 'b=3; c=1']),
+                        'x-user': rng.choice(['alice', 'bob', 1, 1.0, True, None, ['alice', 1]]),
+                    },
+                },
+                'route': {'tags': rng.sample(['a', 'b', 'c'], rng.randint(0, 3))},
+            }
+
+        options = {
+            'do_convert_ts': True,
+            'do_hash_ip': True,
+            'do_hash_auth': True,
+            'do_hash_cookie': True,
+            'hash_paths': ['request.headers.x-user', 'route.tags[]'],
+            'expose_ips': frozenset([hash_value('5.6.7.8')]),
+        }
+
+        for key in [None, b'secret']:
+            hasher = Hasher(key=key)
+            for size in [2, 10, 100]:
+                with self.subTest(key=key, size=size):
+                    logs = [random_log() for _ in range(size)]
+                    expected = [transform_log(log, hasher=hasher, **options) for log in logs]
+                    self.assertEqual(expected, transform_logs(logs, hasher=hasher, **options))
+
+    def test_truncate_values_hashed_small_limit(self):
+        # The hash doesn't fit within small limits, so values are truncated without it.
+        test_log = {'user': 'abcdefghijklmnopqrst'}
+
+        for limit in [1, 16, 25]:
+            with self.subTest(limit=limit):
+                result = transform_log(test_log,
+                                       value_limits=compile_value_limits(limit),
+                                       hash_truncated_values=True)
+                self.assertEqual(test_log['user'][:limit], result['user'])
@@ -0,0 +1,43 @@
+import unittest
+
+from elasticsearch import ConnectionError, TransportError
+
+from kong_log_bridge.warmup import warm_es_connections
+
+from .helpers import FakeEsClient
+
+
+class FakeConnection:
+
+    def __init__(self, host, errors=()):
+        self.host = host
+        self.errors = list(errors)
+        self.requests = 0
+
+    def perform_request(self, method, url, timeout):
+        self.requests += 1
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+class Test(unittest.TestCase):
+
+    def test_warm_es_connections(self):
+        connections = [FakeConnection('es1'),
+                       # Error responses show the node can be reached.
+                       FakeConnection('es2', errors=[TransportError(403, 'Forbidden', {})])]
+
+        self.assertTrue(warm_es_connections(FakeEsClient(connections=connections), 3, timeout_s=1))
+        self.assertEqual([3, 3], [c.requests for c in connections])
+
+    def test_warm_es_connections_retry(self):
+        connection = FakeConnection('es1', errors=[ConnectionError('N/A', 'Refused', None)])
+
+        self.assertTrue(warm_es_connections(FakeEsClient(connections=[connection]), 2, timeout_s=5))
+        self.assertEqual(4, connection.requests)
+
+    def test_warm_es_connections_timeout(self):
+        connection = FakeConnection('es1', errors=[ConnectionError('N/A', 'Refused', None)] * 100)
+
+        self.assertFalse(warm_es_connections(FakeEsClient(connections=[connection]), 2, timeout_s=0))
+        self.assertEqual(2, connection.requests)
@@ -0,0 +1,67 @@
+import logging
+import random
+
+from aiohttp import web
+from time import perf_counter
+
+from .logging import (REQUEST_ERROR_LOG_FORMAT, REQUEST_LOG_FORMAT, STAGE_TIMER_ENVIRON_KEY,
+                      StageTimer)
+
+
+def aio_log_middleware(request_logger=None, timing_sample_rate=1.0):
+    """
+    aiohttp middleware to provide structured logging for requests.
+
+    Logs are equivalent to those from `wsgi_log_middleware()`. A `timing_sample_rate` proportion of
+    requests will have a StageTimer added to the request, and the recorded stage timings included in
+    their request log.
+    """
+
+    if request_logger is None:
+        request_logger = logging.getLogger('aio_request')
+
+    @web.middleware
+    async def aio_log_wrapper(request, handler):
+        start = perf_counter()
+
+        stage_timer = None
+        if timing_sample_rate >= 1 or random.random() < timing_sample_rate:
+            stage_timer = StageTimer()
+            request[STAGE_TIMER_ENVIRON_KEY] = stage_timer
+
+        log_vals = {
+            'remote_address': request.remote,
+            'request_protocol': f'HTTP/{request.version.major}.{request.version.minor}',
+            'request_method': request.method,
+            'request_path': request.path,
+        }
+
+        def log_response(response):
+            elapsed_time = perf_counter() - start
+            log_vals.update({
+                'status_code': response.status,
+                'elapsed_time': int(elapsed_time * 1000),
+                'content_length': response.content_length or 0,
+            })
+            if stage_timer is not None:
+                log_vals.update({
+                    'elapsed_time_us': int(elapsed_time * 1_000_000),
+                    'stage_times_us': stage_timer.timings,
+                })
+            request_logger.info(REQUEST_LOG_FORMAT, log_vals)
+
+        try:
+            response = await handler(request)
+
+        except web.HTTPException as http_exception:
+            log_response(http_exception)
+            raise
+
+        except Exception:
+            request_logger.exception(REQUEST_ERROR_LOG_FORMAT, log_vals)
+            raise
+
+        log_response(response)
+        return response
+
+    return aio_log_wrapper
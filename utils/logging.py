@@ -1,13 +1,63 @@
 import logging
+import random
+
+from contextlib import contextmanager
 from jog import JogFormatter
 from time import perf_counter
 
 REQUEST_LOG_FORMAT = '%(remote_address)s %(request_protocol)s %(request_method)s %(request_path)s %(status_code)d %(elapsed_time)dms %(content_length)dB'
 REQUEST_ERROR_LOG_FORMAT = '%(remote_address)s %(request_protocol)s %(request_method)s %(request_path)s'
 
+# WSGI environ key the request's StageTimer is stored under.
+STAGE_TIMER_ENVIRON_KEY = 'utils.stage_timer'
+
+
+class StageTimer:
+    """
+    Records how long named stages of handling a request take, in microseconds.
+
+    Applications should fetch the timer from the WSGI environ with `get_stage_timer()`, and wrap
+    each stage in a `with timer.time('stage_name'):` block.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def time(self, stage):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = int((perf_counter() - start) * 1_000_000)
+
+
+class NullStageTimer:
+    """A StageTimer that doesn't record anything, used for requests that aren't sampled."""
+
+    timings = None
 
-def wsgi_log_middleware(application, request_logger=None):
-    """WSGI middleware to provide structured logging for requests."""
+    @contextmanager
+    def time(self, stage):
+        yield
+
+
+NULL_STAGE_TIMER = NullStageTimer()
+
+
+def get_stage_timer(environ):
+    """Get the StageTimer for a request, or a no-op timer if the request isn't being timed."""
+
+    return environ.get(STAGE_TIMER_ENVIRON_KEY, NULL_STAGE_TIMER)
+
+
+def wsgi_log_middleware(application, request_logger=None, timing_sample_rate=1.0):
+    """
+    WSGI middleware to provide structured logging for requests.
+
+    A `timing_sample_rate` proportion of requests will have a StageTimer added to their WSGI
+    environ, and the recorded stage timings included in their request log.
+    """
 
     if request_logger is None:
         request_logger = logging.getLogger('wsgi_request')
@@ -16,6 +66,11 @@ def wsgi_log_middleware(application, request_logger=None):
     def wsgi_log_wrapper(environ, start_response):
         start = perf_counter()
 
+        stage_timer = None
+        if timing_sample_rate >= 1 or random.random() < timing_sample_rate:
+            stage_timer = StageTimer()
+            environ[STAGE_TIMER_ENVIRON_KEY] = stage_timer
+
         log_vals = {
             'remote_address': environ.get('REMOTE_ADDR'),
             'request_protocol': environ.get('SERVER_PROTOCOL'),
@@ -59,11 +114,17 @@ def wsgi_log_middleware(application, request_logger=None):
         #       was provided.
         content_length = content_lengths[-1] if content_lengths else len(b''.join(retval))
 
+        elapsed_time = perf_counter() - start
         log_vals.update({
             'status_code': status_codes[-1],
-            'elapsed_time': int((perf_counter() - start) * 1000),
+            'elapsed_time': int(elapsed_time * 1000),
             'content_length': content_length,
         })
+        if stage_timer is not None:
+            log_vals.update({
+                'elapsed_time_us': int(elapsed_time * 1_000_000),
+                'stage_times_us': stage_timer.timings,
+            })
         request_logger.info(REQUEST_LOG_FORMAT, log_vals)
 
         return retval
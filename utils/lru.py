@@ -0,0 +1,41 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A dict-like cache holding up to `max_size` entries.
+
+    When the cache is full, adding a new entry evicts the least recently used entry.
+    """
+
+    def __init__(self, max_size):
+        if max_size < 1:
+            raise ValueError('LRU cache max size must be at least 1')
+
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Get the value for a key, marking it as recently used."""
+
+        try:
+            self._entries.move_to_end(key)
+        except KeyError:
+            return default
+
+        return self._entries[key]
+
+    def put(self, key, value):
+        """Set the value for a key, marking it as recently used and evicting an entry if needed."""
+
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)